@@ -0,0 +1,252 @@
+'''
+asyncio version of the RS485 bus session and ERV/HRV control classes.
+
+Reads are registered with the event loop (add_reader), so a command
+never blocks the loop while it waits for the ERV. Commands and any
+number of watchers share one serial port. Commands use the same
+TRANSACTION state machine as the synchronous BUS.
+
+Module import usage in script:
+  import asyncio
+  from aiobus import AIOBUS, AIOVAUTOW
+
+  async def main():
+      async with AIOBUS('/dev/ttyUSB0') as bus:
+          erv = AIOVAUTOW(bus=bus)
+          watcher = asyncio.create_task(show(bus))
+          await asyncio.wait_for(erv.standby(), timeout=2)
+          erv.status
+          watcher.cancel()
+
+  async def show(bus):
+      async for frame in bus.watch():
+          print(frame.hex())
+
+  asyncio.run(main())
+'''
+
+import asyncio
+import os
+import serial
+from bus import BUS, TRANSACTION
+from vautow import VAUTOW, FRAMES as VAUTOW_FRAMES, NAMES as VAUTOW_NAMES
+from vttouchw import VTTOUCHW, FRAMES as VTTOUCHW_FRAMES, NAMES as VTTOUCHW_NAMES
+
+class AIOBUS(BUS):
+    def __init__(self,port='/dev/ttyUSB0',baudrate=38400,timeout=0.1,delay_before_tx=0.005,backend=None):
+        super().__init__(port,baudrate,timeout,delay_before_tx,backend)
+        self.read_interval = 0  # Non-blocking reads, the event loop says when data is waiting
+        self.loop = None
+        self.lock = asyncio.Lock()  # One command on the bus at a time
+        self.transaction = None
+        self.wake = None
+        self.watchers = set()
+        self.dropped = 0  # Frames a slow watcher did not have room for
+        self.reconnecting = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    async def connect(self):
+        '''
+        Open the port (if needed) and register it with the running event loop.
+        '''
+        if self.ser is not None:
+            return self
+        if self.reconnecting is not None:
+            await asyncio.shield(self.reconnecting)
+            if self.ser is None:
+                raise serial.SerialException(f'{self.port} serial port not found')
+            return self
+        self.loop = asyncio.get_running_loop()
+        self.open()
+        self.loop.add_reader(self.ser.fileno(), self._readable)
+        return self
+
+    def close(self):
+        if self.ser is not None and self.loop is not None:
+            self.loop.remove_reader(self.ser.fileno())
+        super().close()
+
+    def _readable(self):
+        '''Event loop callback, the serial port has data waiting.'''
+        try:
+            data = os.read(self.ser.fileno(), 4096)
+            if not data:
+                raise serial.SerialException('device reports readiness to read but returned no data')
+        except OSError as e:
+            return self._lost(e)
+        now = self.loop.time()
+        transaction = self.transaction
+        for frame in self.parser.feed(data):
+            for listener in self.listeners:
+                listener(frame, now)
+            if self.watchers:
+                copy = bytes(frame)  # The frame view is only valid until the next read
+                for queue in self.watchers:
+                    if queue.full():
+                        self.dropped += 1
+                    else:
+                        queue.put_nowait(copy)
+            if transaction is not None and not transaction.done:
+                data = transaction.feed(frame, now)
+                if data:
+                    self._write(data)
+                if data or transaction.done:
+                    self._wake()
+
+    def _write(self, data):
+        if self.ser is None:
+            return  # Lost the port, the command loop reconnects
+        # With RS485 RTS toggling, pySerial sleeps delay_before_tx and waits for
+        # the frame to drain, which holds the loop for a few milliseconds per frame
+        # (backend='termios' leaves that to the kernel and returns at once).
+        try:
+            self.ser.write(data)
+        except OSError as e:
+            self._lost(e)
+
+    def _wake(self):
+        if self.wake is not None and not self.wake.done():
+            self.wake.set_result(None)
+
+    def _lost(self, error):
+        '''The USB adapter went away, start reconnecting and let the current command wait for it.'''
+        self.close()
+        self._wake()
+        if self.reconnecting is None:
+            self.reconnecting = self.loop.create_task(self._reconnect(error))
+
+    async def _reconnect(self, error):
+        try:
+            for i in range(self.reconnect_attempts):
+                await asyncio.sleep(self.reconnect_delay)
+                try:
+                    self.open()
+                except OSError as e:
+                    error = e
+                    continue
+                self.reconnects += 1
+                self.loop.add_reader(self.ser.fileno(), self._readable)
+                return
+            print(f'{self.port} serial port not found ({error})')
+            for queue in self.watchers:
+                queue.put_nowait(None)  # Tell watchers the port is gone for good
+        finally:
+            self.reconnecting = None
+
+    async def watch(self, maxsize=1000):
+        '''
+        Yield every frame seen on the bus (as bytes) while commands run.
+        '''
+        await self.connect()
+        queue = asyncio.Queue(maxsize)
+        self.watchers.add(queue)
+        try:
+            while True:
+                frame = await queue.get()
+                if frame is None:
+                    raise serial.SerialException(f'{self.port} serial port not found')
+                yield frame
+        finally:
+            self.watchers.discard(queue)
+
+    async def mode(self, max_age=10, listen=3.5):
+        '''
+        Async BUS.mode(), the tracker is fed by every frame so this is
+        instant unless the ERV has not reported its mode recently.
+        '''
+        await self.connect()
+        deadline = self.loop.time() + listen
+        while self.tracker.current(max_age) is None and self.loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        return self.tracker.current(max_age)
+
+    async def command(self, frames, expect, attempts=8):
+        '''
+        Async BUS.command(), returns the number of attempts used (0 = FAILED).
+        Cancelling the task stops the command between frames.
+        If the adapter is unplugged the command carries on after it reconnects.
+        '''
+        async with self.lock:
+            await self.connect()
+            transaction = TRANSACTION(frames, expect, attempts, self.timeout, self.gap_timeout)
+            self.transaction = transaction
+            began = self.loop.time()
+            try:
+                transaction.start(began)
+                while not transaction.done:
+                    if self.ser is None:
+                        await self.connect()  # Waits for the reconnect, raises if the adapter stays gone
+                    self.wake = self.loop.create_future()
+                    timer = self.loop.call_at(transaction.deadline, self._wake)
+                    try:
+                        await self.wake  # Woken by _readable() or the deadline timer
+                    finally:
+                        timer.cancel()
+                    data = transaction.tick(self.loop.time())
+                    if data:
+                        self._write(data)
+            finally:
+                self.transaction = None
+                self.wake = None
+        self.results[transaction.used] = self.results.get(transaction.used, 0) + 1
+        if self.metrics is not None:
+            self.metrics.command(self.port, transaction.used, self.loop.time() - began)
+        return transaction.used
+
+
+class AIOVAUTOW(VAUTOW):
+    '''
+    VAUTOW where every command is a coroutine, i.e. await erv.standby()
+    '''
+    def __init__(self,port='/dev/ttyUSB0',bus=None):
+        super().__init__(port,bus)
+        if bus is None:
+            self.bus = AIOBUS(port,self.baudrate,self.timeout,self.delay_before_tx)
+
+    async def mode(self):
+        code = await self.bus.mode(self.max_age)
+        return VAUTOW_NAMES.get(code, code)
+
+    async def send_frames(self, command):
+        self.state = command
+        if self._already(command):
+            return None
+        frames, expect = VAUTOW_FRAMES[command]
+        try:
+            used = await self.bus.command(frames, expect, self.attempts)
+        except OSError:
+            self.status = 'FAILED'
+            return print(f'{self.port} serial port not found')
+        return self._finish(used)
+
+
+class AIOVTTOUCHW(VTTOUCHW):
+    '''
+    VTTOUCHW where every command is a coroutine, i.e. await erv.smart()
+    '''
+    def __init__(self,port='/dev/ttyUSB0',bus=None):
+        super().__init__(port,bus)
+        if bus is None:
+            self.bus = AIOBUS(port,self.baudrate,self.timeout,self.delay_before_tx)
+
+    async def mode(self):
+        code = await self.bus.mode(self.max_age)
+        return VTTOUCHW_NAMES.get(code, code)
+
+    async def send_frames(self, command):
+        self.state = command
+        if self._already(command):
+            return None
+        frames, expect = VTTOUCHW_FRAMES[command]
+        try:
+            used = await self.bus.command(frames, expect, self.attempts)
+        except OSError:
+            self.status = 'FAILED'
+            return print(f'{self.port} serial port not found')
+        return self._finish(used)
@@ -0,0 +1,130 @@
+'''
+Run a sequence of ERV commands from a script file or stdin on one open
+serial port, for cron and shell automation ("recirc, wait 20 min,
+auto") without starting Python and reopening the tty for every step.
+
+Script format, one step per line:
+  recirc          <-- Any command from the commands listing
+  wait 20m        <-- Also 90s, 1.5h or plain seconds (sleep works too)
+  mode            <-- Mode the ERV reports on the bus
+  # comment
+
+Each step prints one JSON line when it finishes:
+  {"step": 1, "line": 1, "command": "recirc", "ok": true, "status": ".OK", "seconds": 0.052, "time": 1700000000.1}
+  {"step": 2, "line": 2, "wait": 1200.0, "ok": true, "seconds": 1200.0, "time": 1700001200.2}
+The dots and OK/FAILED the classes print go to stderr. If ervd.py owns
+the port, the commands go through the daemon (the port stays with it
+during waits). The exit status is 1 if any step failed.
+
+Command-line Usage:
+  python3 vautow.py /dev/ttyUSB0 --script evening.txt
+  printf 'recirc\nwait 20m\nauto\n' | python3 vautow.py /dev/ttyUSB0 -
+'''
+
+import contextlib
+import json
+import sys
+from time import time, sleep, perf_counter
+
+UNITS = {'s': 1, 'm': 60, 'h': 3600}
+
+def duration(text):
+    '''Seconds in "90", "90s", "20m" or "1.5h".'''
+    text = text.strip().lower()
+    if text[-1:] in UNITS:
+        return float(text[:-1]) * UNITS[text[-1]]
+    return float(text)
+
+
+def steps(lines):
+    '''Yield (line number, words) for every line that is not blank or a comment.'''
+    for number, line in enumerate(lines, 1):
+        words = line.split('#', 1)[0].split()
+        if words:
+            yield number, words
+
+
+def daemon_request(message):
+    '''ervd.request() for a daemon that was running when the script started.'''
+    from ervd import request
+    reply = request(message)
+    if reply is None:
+        raise OSError('ervd stopped while the script was running')
+    return reply
+
+
+def run(device, port, lines, out=sys.stdout):
+    '''
+    Run every step in lines on one port. Returns True if every step succeeded.
+    '''
+    from ervd import request
+    probe = request({'request': 'commands', 'port': port, 'device': device})
+    daemon = probe is not None and not probe.get('elsewhere')
+    erv = None
+    if daemon:
+        if 'commands' not in probe:
+            print(f"ERROR: {probe.get('error')}", file=sys.stderr)
+            return False
+        command_list = probe['commands']
+    else:
+        if device == 'vautow':
+            from vautow import VAUTOW as ERV
+        else:
+            from vttouchw import VTTOUCHW as ERV
+        erv = ERV(port)  # Opens the port on the first command and keeps it open
+        command_list = erv.command_list
+    success = True
+    try:
+        for step, (number, words) in enumerate(steps(lines), 1):
+            result = {'step': step, 'line': number}
+            began = perf_counter()
+            name = words[0].lower()
+            try:
+                if name in ('wait', 'sleep'):
+                    if len(words) != 2:
+                        raise ValueError(f'{name} needs one duration, i.e. {name} 20m')
+                    result['wait'] = duration(words[1])
+                    sleep(result['wait'])
+                    result['ok'] = True
+                elif name == 'mode':
+                    result['command'] = name
+                    if daemon:
+                        reply = daemon_request({'request': 'state', 'port': port, 'device': device})
+                        result['mode'] = reply.get('mode')
+                        if reply.get('error'):
+                            result['error'] = reply['error']
+                    else:
+                        result['mode'] = erv.mode()
+                    result['ok'] = result['mode'] is not None
+                elif name in command_list and len(words) == 1:
+                    result['command'] = name
+                    if daemon:
+                        reply = daemon_request({'request': 'command', 'port': port, 'device': device, 'command': name})
+                        result['ok'], result['status'] = reply.get('ok', False), reply.get('status')
+                        if reply.get('error'):
+                            result['error'] = reply['error']
+                    else:
+                        with contextlib.redirect_stdout(sys.stderr):
+                            getattr(erv, name)()
+                        result['ok'], result['status'] = erv.status.endswith('OK'), erv.status
+                else:
+                    raise ValueError(f"{' '.join(words)} command not found")
+            except (ValueError, OSError) as e:
+                result['ok'] = False
+                result['error'] = str(e)
+            result['seconds'] = round(perf_counter() - began, 4)
+            result['time'] = round(time(), 3)
+            success = success and result['ok']
+            print(json.dumps(result), file=out, flush=True)
+    finally:
+        if erv is not None:
+            erv.bus.close()
+    return success
+
+
+def main(device, port, source):
+    '''Command-line entry for vautow.py and vttouchw.py: source is a file name or - for stdin.'''
+    if source == '-':
+        return run(device, port, sys.stdin)
+    with open(source) as lines:
+        return run(device, port, lines)
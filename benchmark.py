@@ -0,0 +1,168 @@
+'''
+Benchmarks for command latency, attempts per command, and frame
+parsing/filtering throughput, run against the pty bus simulator
+(simulator.py) so no ERV is needed.
+
+  Command latency   Every mode in command_list for VAUTOW and VTTOUCHW,
+                    p50/p95/p99 milliseconds per send_frames() call (except VAUTOW INT,
+                    which is sent from a torn capture, see vautow.CAPTURED)
+  Attempts          Histogram of attempts used per command (0 = FAILED, out of 8)
+  Parsing           Frames/sec through PARSER (frames.py)
+  Skip filtering    Frames/sec through the old bytes(frame).startswith(skip) prefix lists
+  Classifying       Frames/sec through classify() (classify.py), which replaced them
+  Backends          VTTOUCHW command latency with the pySerial and termios (rs485.py)
+                    serial ports. The pty has no RS485 driver enable, so this compares
+                    the user-space I/O paths, not the kernel TIOCSRS485 timing
+
+Results are written as JSON so runs can be compared across changes.
+The MicroPython send_frames() (11 attempts) is not covered, it needs the ESP32.
+
+Command-line Usage:
+  python3 benchmark.py
+  python3 benchmark.py --rounds 20 --speed 1 --json before.json
+  python3 benchmark.py --collisions 0.1 --drops 0.001 --json noisy.json
+'''
+
+import contextlib
+import io
+import json
+import math
+import platform
+import sys
+from time import perf_counter, time
+from frames import FRAME, PARSER, SAMPLES
+from classify import benchmark as classify_throughput
+from simulator import SIMULATOR
+
+# Poll call/response frames, matched as prefixes like the skip tuples the watch scripts used before classify.py
+SKIP = (
+    b'\x01\x10\x11\x01\x01\x04\xd9\x04', b'\x01\x10\x11\x01\x01\x05\xd8\x04',
+    b'\x01\x11\x10\x01\x01\x04\xd9\x04', b'\x01\x11\x10\x01\x01\x05\xd8\x04',
+    b'\x01\x10\x12\x01\x01\x04', b'\x01\x12\x10\x01\x01\x05\xd7\x04',
+    b'\x01\x12\x10\x01\x01\x04', b'\x01\x10\x12\x01\x01\x05\xd7\x04',
+    )
+
+
+def percentile(values, percent):
+    '''Nearest-rank percentile of a sorted list.'''
+    if not values:
+        return None
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def summary(latencies):
+    values = sorted(latencies)
+    return {'count': len(values),
+            'p50_ms': percentile(values, 50),
+            'p95_ms': percentile(values, 95),
+            'p99_ms': percentile(values, 99),
+            'mean_ms': sum(values) / len(values) if values else None,
+            'max_ms': values[-1] if values else None}
+
+
+def command_latency(device, rounds=10, speed=1.0, collisions=0.0, drops=0.0, backend='pyserial'):
+    '''
+    Send every command in command_list rounds times through a simulated bus.
+    '''
+    from bus import BUS
+    if device == 'vautow':
+        from vautow import VAUTOW as ERV, CAPTURED
+    else:
+        from vttouchw import VTTOUCHW as ERV
+        CAPTURED = {}
+    latencies = []
+    modes = {}
+    with SIMULATOR(device, speed=speed, collisions=collisions, drops=drops, seed=0) as sim:
+        erv = ERV(sim.port, bus=BUS(sim.port, backend=backend))
+        erv.skip_redundant = False  # Always go to the bus, even for the mode the ERV is already in
+        with contextlib.redirect_stdout(io.StringIO()):  # send_frames() prints a status line
+            for i in range(rounds):
+                for command in erv.command_list:
+                    if command in CAPTURED:
+                        continue  # Sent from a torn capture, not a latency figure
+                    began = perf_counter()
+                    erv.send_frames(command)
+                    elapsed = (perf_counter() - began) * 1000
+                    latencies.append(elapsed)
+                    modes.setdefault(command, []).append(elapsed)
+        erv.bus.close()
+        results = erv.bus.results
+        simulated = sim.stats()
+    failed = results.get(0, 0)
+    return dict(summary(latencies),
+                ok=len(latencies) - failed,
+                failed=failed,
+                attempts={str(n): results[n] for n in sorted(results)},
+                modes={command: summary(values) for command, values in modes.items()},
+                simulator=simulated)
+
+
+def parse_throughput(seconds=2.0, chunk=64):
+    '''Frames/sec through PARSER for the SAMPLES stream fed in chunk byte reads.'''
+    stream = bytes.fromhex(''.join(SAMPLES)) * 512
+    parser = PARSER()
+    frames = total = 0
+    began = perf_counter()
+    while perf_counter() - began < seconds:
+        for i in range(0, len(stream), chunk):
+            for frame in parser.feed(stream[i:i + chunk]):
+                frames += 1
+        total += len(stream)
+    elapsed = perf_counter() - began
+    return {'frames_per_sec': frames / elapsed, 'bytes_per_sec': total / elapsed,
+            'chunk_bytes': chunk, 'errors': parser.errors}
+
+
+def skip_throughput(seconds=2.0):
+    '''Frames/sec through a skip prefix list, a quarter of the SAMPLES are polls.'''
+    frames = [FRAME(memoryview(bytes.fromhex(sample))) for sample in SAMPLES] * 512
+    shown = checked = 0
+    began = perf_counter()
+    while perf_counter() - began < seconds:
+        for frame in frames:
+            if not bytes(frame).startswith(SKIP):
+                shown += 1
+        checked += len(frames)
+    elapsed = perf_counter() - began
+    return {'frames_per_sec': checked / elapsed, 'shown': shown / checked}
+
+
+def run(rounds=10, speed=1.0, collisions=0.0, drops=0.0, seconds=2.0):
+    return {
+        'time': time(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'settings': {'rounds': rounds, 'speed': speed, 'collisions': collisions, 'drops': drops},
+        'commands': {device: command_latency(device, rounds, speed, collisions, drops)
+                     for device in ('vautow', 'vttouchw')},
+        'parse': parse_throughput(seconds),
+        'skip': skip_throughput(seconds),
+        'classify': classify_throughput(seconds),
+        'backends': {backend: command_latency('vttouchw', rounds, speed, collisions, drops, backend)
+                     for backend in ('pyserial', 'termios')},
+        }
+
+
+def report(results):
+    for device, result in results['commands'].items():
+        histogram = ' '.join(f'{n}:{count}' for n, count in result['attempts'].items())
+        print(f"{device:9s} {result['ok']}/{result['count']} OK  "
+              f"p50 {result['p50_ms']:.1f} ms  p95 {result['p95_ms']:.1f} ms  p99 {result['p99_ms']:.1f} ms  "
+              f"attempts (0=FAILED) {histogram}")
+    print(f"parse     {results['parse']['frames_per_sec']:,.0f} frames/sec  "
+          f"{results['parse']['bytes_per_sec']:,.0f} bytes/sec")
+    print(f"skip      {results['skip']['frames_per_sec']:,.0f} frames/sec")
+    print(f"classify  {results['classify']['frames_per_sec']:,.0f} frames/sec")
+    for backend, result in results['backends'].items():
+        print(f"{backend:9s} vttouchw p50 {result['p50_ms']:.1f} ms  p95 {result['p95_ms']:.1f} ms  "
+              f"p99 {result['p99_ms']:.1f} ms  mean {result['mean_ms']:.1f} ms")
+
+
+if __name__ == '__main__':
+    option = lambda name, default, kind=float: kind(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+    results = run(option('--rounds', 10, int), option('--speed', 1.0), option('--collisions', 0.0),
+                  option('--drops', 0.0), option('--seconds', 2.0))
+    report(results)
+    if '--json' in sys.argv:
+        with open(option('--json', None, str), 'w') as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,266 @@
+'''
+Long-lived RS485 session that owns the USB-to-RS485 serial port.
+
+The port is opened on first use and stays open between commands.
+If the USB adapter is unplugged the next read or write closes the
+port and keeps trying to reopen it before giving up.
+
+Module import usage in script:
+  from bus import BUS
+  from vautow import VAUTOW
+  from vttouchw import VTTOUCHW
+  with BUS('/dev/ttyUSB0') as bus:
+      VAUTOW(bus=bus).standby()
+      VTTOUCHW(bus=bus).smart()
+
+The port is opened with pySerial, or with termios and the kernel RS485
+driver enable (rs485.py) when backend='termios' or ERV_BACKEND=termios.
+'''
+
+import errno
+import os
+import serial.rs485
+from time import sleep, monotonic
+from frames import PARSER, OVERHEAD
+from tracker import TRACKER
+from telemetry import TELEMETRY
+
+BACKEND = os.environ.get('ERV_BACKEND', 'pyserial')  # or 'termios'
+
+class BUS:
+    def __init__(self,port='/dev/ttyUSB0',baudrate=38400,timeout=0.1,delay_before_tx=0.005,backend=None):
+        self.port = port
+        self.backend = backend or BACKEND
+        self.baudrate = baudrate
+        self.timeout = timeout            # Seconds to wait for each ERV response frame
+        self.gap_timeout = 0.1            # Seconds to listen for a poll exchange before transmitting anyway
+        self.read_interval = 0.005        # Serial read timeout while listening to the bus
+        self.delay_before_tx = delay_before_tx
+        self.reconnect_attempts = 5
+        self.reconnect_delay = 0.5
+        self.reconnects = 0
+        self.opens = 0
+        self.ser = None
+        self.parser = PARSER()
+        self.tracker = TRACKER()          # ERV mode decoded from every frame this session sees
+        self.telemetry = TELEMETRY()      # Register values decoded from every frame this session sees
+        self.listeners = [self.tracker.feed, self.telemetry.feed]  # Called with (frame, now) for every frame
+        self.results = {}                 # Attempts used -> number of commands (0 = FAILED)
+        self.metrics = None               # METRICS (metrics.py) while measuring
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        '''
+        Open and configure the serial port for RS485.
+        '''
+        if self.backend == 'termios':
+            from rs485 import TERMIOS
+            self.ser = TERMIOS(self.port,self.baudrate,self.read_interval,self.delay_before_tx)
+            self.parser.reset()
+            self.opens += 1
+            return self
+        self.ser = serial.rs485.RS485(port=self.port,baudrate=self.baudrate,timeout=self.read_interval)
+        self.ser.rs485_mode = serial.rs485.RS485Settings(
+            rts_level_for_tx=False,
+            rts_level_for_rx=True,
+            delay_before_tx=self.delay_before_tx)
+        try:
+            self.ser.rts = True  # Receive level, also checks the port has an RTS line
+        except OSError as e:
+            if e.errno not in (errno.ENOTTY, errno.EINVAL):
+                raise
+            self.ser.rs485_mode = None  # Pseudo-terminals and some adapters have no RTS line to toggle
+        self.parser.reset()
+        self.opens += 1
+        return self
+
+    def close(self):
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except OSError:
+                pass  # Adapter already gone
+            self.ser = None
+
+    def _call(self, function):
+        '''
+        Run function(serial port), reopening the port if the adapter went away.
+        '''
+        for i in range(self.reconnect_attempts + 1):
+            try:
+                if self.ser is None:
+                    self.open()
+                return function(self.ser)
+            except OSError as e:  # serial.SerialException is an OSError, unplugged adapter = EIO/ENXIO
+                error = e
+            self.close()
+            if not self.opens:
+                break  # Never opened, so the port name is wrong rather than unplugged
+            self.reconnects += 1
+            sleep(self.reconnect_delay)
+        raise serial.SerialException(f'{self.port} serial port not found ({error})')
+
+    def write(self, data):
+        return self._call(lambda ser: ser.write(data))
+
+    def read(self):
+        '''Read whatever is waiting, or block up to read_interval for one byte.'''
+        return self._call(lambda ser: ser.read(ser.in_waiting or 1))
+
+    def reset_input_buffer(self):
+        self.parser.reset()
+        return self._call(lambda ser: ser.reset_input_buffer())
+
+    def frames(self, deadline):
+        '''
+        Yield frames seen on the bus until the monotonic() deadline.
+        '''
+        while monotonic() < deadline:
+            chunk = self.read()
+            now = monotonic()
+            for frame in self.parser.feed(chunk):
+                for listener in self.listeners:
+                    listener(frame, now)
+                yield frame
+
+    def mode(self, max_age=10, listen=3.5):
+        '''
+        ERV mode byte from the tracker, listening to the bus for up to
+        listen seconds (the telemetry exchange repeats every ~3 seconds)
+        if the ERV has not reported it within max_age seconds.
+        '''
+        if self.tracker.current(max_age) is None:
+            self.reset_input_buffer()
+            for frame in self.frames(monotonic() + listen):
+                if self.tracker.current(max_age) is not None:
+                    break
+        return self.tracker.current(max_age)
+
+    def command(self, frames, expect, attempts=8):
+        '''
+        Write the command frames into the idle gap after a poll exchange,
+        one call/response at a time, until the expected ERV response is seen.
+        Returns the number of attempts used, or 0 if all attempts failed.
+        '''
+        # pySerial RS485 support WARNING: This may work unreliably on some serial
+        # ports (control signals not synchronized or delayed compared to data). Using
+        # delays may be unreliable (varying times, larger than expected) as the OS
+        # may not support very fine grained delays.
+        transaction = TRANSACTION(frames, expect, attempts, self.timeout, self.gap_timeout)
+        self.reset_input_buffer()  # Port stays open, so ignore bus traffic from before this command
+        began = monotonic()
+        data = transaction.start(began)
+        while not transaction.done:
+            if data:
+                self.write(data)
+            data = None
+            chunk = self.read()
+            now = monotonic()
+            for frame in self.parser.feed(chunk):
+                for listener in self.listeners:
+                    listener(frame, now)
+                data = transaction.feed(frame, now)
+                if data or transaction.done:
+                    break
+            else:
+                data = transaction.tick(now)
+        self.results[transaction.used] = self.results.get(transaction.used, 0) + 1
+        if self.metrics is not None:
+            self.metrics.command(self.port, transaction.used, monotonic() - began)
+        return transaction.used
+
+    def report(self):
+        '''
+        Command success rate and attempts per command since the session started.
+        '''
+        total = sum(self.results.values())
+        if not total:
+            return 'No commands sent'
+        ok = total - self.results.get(0, 0)
+        attempts = sum(n * count for n, count in self.results.items() if n)
+        histogram = ' '.join(f'{n}:{self.results[n]}' for n in sorted(self.results))
+        return (f'{ok}/{total} OK ({100 * ok / total:.0f}%), '
+                f'{self.results.get(1, 0)} on first attempt, '
+                f'{attempts / ok if ok else 0:.2f} attempts per OK command, '
+                f'attempts histogram (0=FAILED) {histogram}')
+
+
+class TRANSACTION:
+    '''
+    Listen-before-talk command state machine shared by BUS and AIOBUS.
+    It does no I/O: feed() it each frame seen on the bus and tick() it when
+    nothing arrives, and both return the next frame to write (or None).
+
+    The ERV and wall control poll every ~18 ms with ~3.5 ms between call
+    and response, so the bus is idle right after the x05 poll response.
+    Each command frame goes into that gap and must be answered by the ERV
+    (Tx and Rx IDs swapped) before the next one is sent. The last frame
+    must be answered by the expected confirmation frame. A frame whose LL
+    does not match its length (the torn VAUTOW INT capture) cannot be
+    answered, so the next frame follows it in the next poll gap.
+    '''
+    def __init__(self, frames, expect, attempts, timeout, gap_timeout):
+        self.frames = frames
+        self.expect = expect
+        self.attempts = attempts
+        self.timeout = timeout
+        self.gap_timeout = gap_timeout
+        self.attempt = 0
+        self.index = None     # Frame waiting for an answer, None while waiting for a poll gap
+        self.pending = 0      # Frame to send in the next poll gap
+        self.deadline = None
+        self.done = False
+        self.used = 0         # Attempts used, 0 = FAILED
+
+    def start(self, now):
+        '''Begin the next attempt by waiting for a poll gap.'''
+        if self.attempt == self.attempts:
+            self.done = True
+            return None
+        self.attempt += 1
+        self.index = None
+        self.pending = 0
+        self.deadline = now + self.gap_timeout
+        return None
+
+    def send(self, index, now):
+        frame = self.frames[index]
+        if len(frame) != frame[4] + OVERHEAD and index < len(self.frames) - 1:
+            self.index, self.pending = None, index + 1  # Nothing answers it, wait for the next poll gap
+            self.deadline = now + self.gap_timeout
+        else:
+            self.index = index
+            self.deadline = now + self.timeout
+        return frame
+
+    def feed(self, frame, now):
+        if self.done:
+            return None
+        if self.index is None:
+            if frame.length == 1 and frame[5] == 0x05:  # End of a poll exchange
+                return self.send(self.pending, now)
+            return self.tick(now)
+        if self.index == len(self.frames) - 1:
+            if frame.view == self.expect:
+                self.done = True
+                self.used = self.attempt
+                return None
+        else:
+            sent = self.frames[self.index]
+            if frame.sender == sent[2] and frame.receiver == sent[1] and frame.length > 1:  # Not a poll
+                return self.send(self.index + 1, now)
+        return self.tick(now)
+
+    def tick(self, now):
+        if self.done or now < self.deadline:
+            return None
+        if self.index is None:
+            return self.send(self.pending, now)  # Quiet bus (or no wall control), transmit anyway
+        self.start(now)  # Collision or no answer, retry in the next poll gap
+        return None
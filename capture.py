@@ -0,0 +1,190 @@
+'''
+Binary bus capture with nanosecond timestamps, for day-long recordings
+that keep the timing hexdump/xxd and the notes_*.txt files lose.
+
+File Encoding:
+  ERVCAP1\\n     8 byte file header
+  then one record per frame, appended as frames arrive:
+  TTTTTTTT      monotonic time in nanoseconds (little-endian uint64)
+  LLLL          frame length in bytes (little-endian uint16)
+  FF ...        frame bytes (01 Tx Rx 01 LL ... CS 04)
+
+Command-line Usage:
+  python3 watch_vttouchw.py --record erv.cap   <-- Record while watching
+  python3 capture.py erv.cap                   <-- Print frames with timestamps
+
+Module import usage in script:
+  from capture import READER, replay
+  for nanoseconds, frame in READER('erv.cap'):   <-- frame is a memoryview into the mmap
+      print(nanoseconds, frame.hex())
+  replay('erv.cap', [telemetry.feed, tracker.feed])            <-- As fast as possible
+  replay('erv.cap', [telemetry.feed], speed=1.0)                <-- Original timing
+  nanoseconds, starts, lengths, data = arrays('erv.cap')        <-- Whole file as NumPy arrays
+'''
+
+import mmap
+import os
+import struct
+from time import monotonic_ns, sleep, perf_counter
+from frames import FRAME, OVERHEAD
+
+MAGIC = b'ERVCAP1\n'
+RECORD = struct.Struct('<QH')
+
+
+class RECORDER:
+    '''
+    Append frames to a capture file. Also usable as a BUS listener:
+      bus.listeners.append(RECORDER('erv.cap').feed)
+    '''
+    def __init__(self, path):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'ab', buffering=65536)
+        if new:
+            self.file.write(MAGIC)
+        self.frames = 0
+
+    def write(self, frame, nanoseconds=None):
+        self.file.write(RECORD.pack(monotonic_ns() if nanoseconds is None else nanoseconds, len(frame)))
+        self.file.write(frame.view if isinstance(frame, FRAME) else frame)
+        self.frames += 1
+
+    def feed(self, frame, now=None):
+        self.write(frame)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class READER:
+    '''
+    Iterate (nanoseconds, frame memoryview) over a capture file without copying.
+    A record cut short at the end of the file (i.e. power loss while recording) is ignored.
+    '''
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.memory = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ) if size else b''
+        if self.memory[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not an ERV capture file')
+        self.view = memoryview(self.memory)
+
+    def __iter__(self):
+        view = self.view
+        unpack = RECORD.unpack_from
+        position = len(MAGIC)
+        end = len(view) - RECORD.size
+        while position <= end:
+            nanoseconds, length = unpack(view, position)
+            position += RECORD.size
+            if position + length > len(view):
+                return
+            yield nanoseconds, view[position:position + length]
+            position += length
+
+    def close(self):
+        self.view.release()
+        if isinstance(self.memory, mmap.mmap):
+            self.memory.close()
+        self.file.close()
+
+
+def replay(path, consumers, speed=None):
+    '''
+    Feed every recorded frame to each consumer(frame, seconds) in order.
+    speed=None runs as fast as possible, speed=1.0 keeps the original timing
+    (2.0 twice as fast). seconds is the capture's own monotonic time.
+    Returns the number of frames replayed.
+    '''
+    reader = READER(path)
+    count = 0
+    first = view = frame = None
+    started = perf_counter()
+    try:
+        for nanoseconds, view in reader:
+            seconds = nanoseconds / 1e9
+            if speed:
+                if first is None:
+                    first = seconds
+                wait = (seconds - first) / speed - (perf_counter() - started)
+                if wait > 0:
+                    sleep(wait)
+            frame = FRAME(view)
+            for consumer in consumers:
+                consumer(frame, seconds)
+            count += 1
+    finally:
+        view = frame = None  # Release the views into the mmap before closing it
+        reader.close()
+    return count
+
+
+def arrays(path, chunk=1 << 24):
+    '''
+    Whole capture as NumPy arrays, for vectorized analysis of day-long files
+    (timing.py): (nanoseconds, frame start offsets into data, frame lengths, data).
+    Record starts are found in fixed-size chunks (a frame whose length matches
+    its record header) and checked to follow each other, with a READER pass
+    as the fallback if anything else is in the file (i.e. a torn frame).
+    '''
+    import numpy as np
+    data = np.fromfile(path, np.uint8)
+    if data[:len(MAGIC)].tobytes() != MAGIC:
+        raise ValueError(f'{path} is not an ERV capture file')
+    last = len(data) - RECORD.size - OVERHEAD  # Last offset with room for a record header and the shortest frame
+    found = []
+    for begin in range(len(MAGIC), last + 1, chunk):
+        end = min(begin + chunk, last + 1)
+        frame = begin + RECORD.size
+        mask = (data[frame:end + RECORD.size] == 0x01) & (data[frame + 3:end + RECORD.size + 3] == 0x01)
+        offsets = np.flatnonzero(mask) + begin
+        lengths = data[offsets + 8] | data[offsets + 9].astype(np.intp) << 8
+        match = lengths == data[offsets + RECORD.size + 4].astype(np.intp) + OVERHEAD
+        offsets, lengths = offsets[match], lengths[match]
+        inside = offsets + RECORD.size + lengths <= len(data)
+        offsets, lengths = offsets[inside], lengths[inside]
+        found.append(offsets[data[offsets + RECORD.size + lengths - 1] == 0x04])
+    offsets = np.concatenate(found) if found else np.empty(0, np.intp)
+    lengths = data[offsets + 8] | data[offsets + 9].astype(np.intp) << 8
+    following = offsets + RECORD.size + lengths
+    chained = len(offsets) and offsets[0] == len(MAGIC) and (following[:-1] == offsets[1:]).all()
+    if chained and following[-1] + RECORD.size <= len(data):  # Something after the last frame found
+        tail = following[-1]
+        chained = tail + RECORD.size + (int(data[tail + 8]) | int(data[tail + 9]) << 8) > len(data)  # Cut short
+    if not chained and len(data) > len(MAGIC):
+        reader = READER(path)
+        try:
+            starts = list(_positions(reader.view))
+        finally:
+            reader.close()
+        offsets = np.array(starts, np.intp) - RECORD.size
+        lengths = data[offsets + 8] | data[offsets + 9].astype(np.intp) << 8
+    stamps = data[offsets[:, None] + np.arange(8)].view('<u8').ravel()
+    return stamps, offsets + RECORD.size, lengths, data
+
+
+def _positions(view):
+    '''Offset of every frame in a capture, record by record.'''
+    position = len(MAGIC)
+    end = len(view) - RECORD.size
+    while position <= end:
+        length = view[position + 8] | view[position + 9] << 8
+        position += RECORD.size
+        if position + length > len(view):
+            return
+        yield position
+        position += length
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 2:
+        print('Example command-line: python3 capture.py erv.cap')
+    else:
+        first = None
+        for nanoseconds, frame in READER(sys.argv[1]):
+            first = nanoseconds if first is None else first
+            print(f'{(nanoseconds - first) / 1e6:12.3f} ms  {frame.hex()}')
@@ -0,0 +1,135 @@
+'''
+Frame classifier for the watch scripts, replacing the hand-maintained
+skip lists of repeating frames and hex string matching.
+
+Every frame gets one class with at most three dict lookups:
+  EXACT       Raw frame bytes -> class, for frames that never change
+              (polls, every command frame and confirmation in FRAMES)
+  REGISTERS   (sender, receiver, opcode, first register) -> class, for
+              the mode registers, the timing/counter register and the
+              periodic x50xx writes
+  PREFIXES    (sender, receiver, opcode) -> class, for register reads
+              whose values change every time (telemetry)
+A x40 write or x41 acknowledgement of any other register is unknown,
+since those are what an undecoded button sends.
+Keys are packed into ints, so nothing is built per frame but the
+bytes() of the frame for EXACT.
+
+Classes:
+  poll          x04 call / x05 response every ~18 ms
+  telemetry     Register reads and responses that repeat (~3 sec mode exchange, ~300 sec),
+                and the periodic x5000-x5007 writes and acknowledgements
+  counter       Timing/counter register x0014 (every 10 sec)
+  control       Command writes of the mode registers (x2000, x2003, x2008, x22xx), x2001 read back
+  confirmation  ERV responses to those (x41 Rx1, x21 Rx3)
+  unknown       Anything else, i.e. a wall control button nobody has decoded yet
+
+Module import usage in script:
+  from classify import classify, CONTROL, CONFIRMATION, UNKNOWN
+  show = {CONTROL, CONFIRMATION, UNKNOWN}
+  for frame in parser.feed(data):
+      if classify(frame) in show:
+          print(frame.hex())
+'''
+
+from frames import FRAME, OVERHEAD, build
+
+POLL = 'poll'
+TELEMETRY = 'telemetry'
+COUNTER = 'counter'
+CONTROL = 'control'
+CONFIRMATION = 'confirmation'
+UNKNOWN = 'unknown'
+CLASSES = (POLL, TELEMETRY, COUNTER, CONTROL, CONFIRMATION, UNKNOWN)
+
+ERV = 0x10
+WALL_CONTROLS = (0x11, 0x12)  # VAUTOW, VTTOUCHW
+
+# First register of command frames and the ERV confirmations:
+# x40 writes / x41 Rx1 acknowledgements, x20 Tx3 read back / x21 Rx3 responses
+CONTROL_REGISTERS = {0x40: (0x2000, 0x2003, 0x2008, 0x2200, 0x2202, 0x2203, 0x2206, 0x2208),
+                     0x20: (0x2001,)}
+COUNTER_REGISTER = 0x0014
+# First register of the writes the ERV repeats on its own (skip lists of the first watch scripts)
+TELEMETRY_WRITE_REGISTERS = (0x5000, 0x5004, 0x5005, 0x5007)
+
+def prefix(sender, receiver, opcode):
+    return sender << 16 | receiver << 8 | opcode
+
+def _tables():
+    from vautow import FRAMES as VAUTOW_FRAMES
+    from vttouchw import FRAMES as VTTOUCHW_FRAMES
+    exact, registers, prefixes = {}, {}, {}
+    for wall in WALL_CONTROLS:
+        for caller, answerer in ((ERV, wall), (wall, ERV)):
+            exact[build(caller, answerer, b'\x04')] = POLL
+            exact[build(answerer, caller, b'\x05')] = POLL
+        # Frames the wall control sends (Tx 10, Rx wall) and the ERV answers (Tx wall, Rx 10)
+        prefixes[prefix(ERV, wall, 0x20)] = TELEMETRY
+        prefixes[prefix(wall, ERV, 0x21)] = TELEMETRY
+        for register in TELEMETRY_WRITE_REGISTERS:
+            registers[prefix(ERV, wall, 0x40) << 16 | register] = TELEMETRY
+            registers[prefix(wall, ERV, 0x41) << 16 | register] = TELEMETRY
+        for request, response in ((0x20, 0x21), (0x40, 0x41)):
+            registers[prefix(ERV, wall, request) << 16 | COUNTER_REGISTER] = COUNTER
+            registers[prefix(wall, ERV, response) << 16 | COUNTER_REGISTER] = COUNTER
+            for register in CONTROL_REGISTERS[request]:
+                registers[prefix(ERV, wall, request) << 16 | register] = CONTROL
+                registers[prefix(wall, ERV, response) << 16 | register] = CONFIRMATION
+    for table in (VAUTOW_FRAMES, VTTOUCHW_FRAMES):
+        for frames, expect in table.values():
+            for frame in frames:
+                exact[frame] = CONTROL
+            exact[expect] = CONFIRMATION
+    return exact, registers, prefixes
+
+EXACT, REGISTERS, PREFIXES = _tables()
+
+
+def classify(frame):
+    '''
+    Class of one complete frame (FRAME, bytes or memoryview).
+    '''
+    view = frame.view if isinstance(frame, FRAME) else frame
+    found = EXACT.get(bytes(view))
+    if found is not None:
+        return found
+    if len(view) < OVERHEAD or len(view) != view[4] + OVERHEAD:
+        return UNKNOWN  # Torn frame
+    length = view[4]
+    if length == 1:
+        return POLL  # Poll call/response from an unknown device pair
+    key = view[1] << 16 | view[2] << 8 | view[5]
+    if length >= 3:
+        found = REGISTERS.get(key << 16 | view[6] | view[7] << 8)
+        if found is not None:
+            return found
+    return PREFIXES.get(key, UNKNOWN)
+
+
+def benchmark(seconds=2.0):
+    '''
+    Frames/sec classified, for comparing with the skip lists in benchmark.py.
+    '''
+    from time import perf_counter
+    from frames import SAMPLES
+    frames = [FRAME(memoryview(bytes.fromhex(sample))) for sample in SAMPLES] * 512
+    counts = dict.fromkeys(CLASSES, 0)
+    checked = 0
+    began = perf_counter()
+    while perf_counter() - began < seconds:
+        for frame in frames:
+            counts[classify(frame)] += 1
+        checked += len(frames)
+    elapsed = perf_counter() - began
+    return {'frames_per_sec': checked / elapsed,
+            'classes': {name: count / checked for name, count in counts.items()}}
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1:  # python3 classify.py 0111100105210120010c8a04 ...
+        for frame in sys.argv[1:]:
+            print(f'{classify(bytes.fromhex(frame)):12s} {frame}')
+    else:
+        print(benchmark())
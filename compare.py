@@ -0,0 +1,195 @@
+'''
+Differential capture analysis, for finding the frames a wall control
+button sends without watching watch_vttouchw.py scroll and growing skip
+lists by hand (i.e. the missing VTTOUCHW Intermittent and Turbo modes).
+
+Record a quiet baseline and a capture around the button press (see
+capture.py), then compare them. Each capture is indexed once into a
+count per distinct frame, so millions of frames compare in seconds.
+Frames are compared by type, (sender, receiver, opcode, first register,
+length), so the x0014 counter or a telemetry value that changes in every
+frame is still one recurring type. The byte positions that vary within
+a type in the baseline are masked, and the rest are expected to stay
+as they are:
+  new       Frame types the baseline never had, or has far less often than
+            the event capture (sigma standard deviations, treating the
+            counts as Poisson), so polls and periodic telemetry drop out
+  changed   Frames of a recurring type that differ from the most common
+            baseline frame at positions that never vary in the baseline,
+            i.e. the mode byte in a x21 response (one entry per new value)
+  missing   Frame types that repeat in the baseline but stopped during the event
+The changed byte positions are marked against the most common baseline
+frame of the same type.
+
+Command-line Usage:
+  python3 watch_vttouchw.py --record baseline.cap      <-- A few minutes, nobody touches anything
+  python3 watch_vttouchw.py --record turbo.cap         <-- Press the button during this one
+  python3 compare.py baseline.cap turbo.cap
+  python3 compare.py baseline.cap turbo.cap --start 20 --end 40 --json turbo.json
+
+Module import usage in script:
+  from compare import INDEX, compare
+  baseline = INDEX('baseline.cap')
+  for group, changes in compare(baseline, INDEX('turbo.cap', start=20, end=40)).items():
+      print(group, changes)
+'''
+
+import math
+from capture import READER
+
+class INDEX:
+    '''Count and first time (seconds from the start) of every distinct frame in a capture.'''
+    def __init__(self, path, start=None, end=None):
+        self.path = path
+        self.counts = {}   # Frame bytes -> count
+        self.first = {}    # Frame bytes -> seconds from the start of the capture
+        self.frames = 0
+        begin = last = None
+        reader = READER(path)
+        try:
+            for nanoseconds, view in reader:
+                if begin is None:
+                    begin = nanoseconds
+                seconds = (nanoseconds - begin) / 1e9
+                if (start is not None and seconds < start) or (end is not None and seconds > end):
+                    continue
+                frame = bytes(view)
+                count = self.counts.get(frame)
+                if count is None:
+                    self.counts[frame] = 1
+                    self.first[frame] = seconds
+                else:
+                    self.counts[frame] = count + 1
+                self.frames += 1
+                last = seconds if last is None or seconds > last else last
+        finally:
+            view = None  # Release the view into the mmap before closing it
+            reader.close()
+        first = min(self.first.values(), default=0.0)
+        self.seconds = max((last or 0.0) - first, 1e-3)  # Length of the indexed span
+        self.types = {}    # Frame type -> [count, most common frame, bit mask of positions that vary]
+        for frame, count in self.counts.items():
+            entry = self.types.get(kind(frame))
+            if entry is None:
+                self.types[kind(frame)] = [count, frame, 0]
+            else:
+                entry[0] += count
+                if count > self.counts[entry[1]]:
+                    entry[1] = frame
+        for frame in self.counts:
+            entry = self.types[kind(frame)]
+            for i in changed(frame, entry[1]):
+                entry[2] |= 1 << i
+
+    def rate(self, key):
+        '''Times per second a frame type was seen.'''
+        entry = self.types.get(key)
+        return entry[0] / self.seconds if entry else 0.0
+
+
+def kind(frame):
+    '''(sender, receiver, opcode, first register, length) of a frame, None where it has none.'''
+    opcode = frame[5] if len(frame) > 7 else None
+    register = frame[6] | frame[7] << 8 if len(frame) > 9 and frame[4] >= 3 else None
+    return frame[1], frame[2], opcode, register, len(frame)
+
+
+def changed(frame, reference):
+    '''Positions (from Frame Start) where two frames of the same length differ, Check Sum left out.'''
+    return [i for i in range(len(frame) - 2) if frame[i] != reference[i]]
+
+
+def compare(baseline, event, sigma=3.0, min_missing=5):
+    '''
+    Frames that changed between two INDEXes, grouped by (sender, receiver, opcode).
+    '''
+    results = {}
+    unusual = {}  # Frame type -> expected count, for types the baseline rate does not explain
+    for key, (count, common, varies) in event.types.items():
+        expected = baseline.rate(key) * event.seconds
+        if count - expected > sigma * math.sqrt(expected) + (1 if expected else 0):
+            unusual[key] = expected
+    changes = {}  # (frame type, stable positions and their values) -> change
+    for frame, count in event.counts.items():
+        key = kind(frame)
+        entry = baseline.types.get(key)
+        if key in unusual:
+            reference, positions, expected = entry[1] if entry else None, None, unusual[key]
+            if reference:
+                positions = changed(frame, reference)
+            signature = (key, frame)
+            change = 'new'
+        elif entry is None:
+            continue  # A few frames of a rare type, within what the baseline explains
+        else:
+            reference, varies = entry[1], entry[2]
+            positions = [i for i in changed(frame, reference) if not varies >> i & 1]
+            if not positions:
+                continue  # Recurring type, only baseline-variable positions differ
+            expected = baseline.rate(key) * event.seconds
+            signature = (key, tuple((i, frame[i]) for i in positions))
+            change = 'changed'
+        first = event.first[frame]
+        known = changes.get(signature)
+        if known is None:
+            changes[signature] = {
+                'change': change, 'frame': frame.hex(), 'count': count, 'expected': round(expected, 2),
+                'type_count': event.types[key][0], 'first': round(first, 6),
+                'reference': reference.hex() if reference else None, 'positions': positions}
+        else:  # Same stable bytes, counter or telemetry positions differ
+            known['count'] += count
+            if first < known['first']:
+                known['first'], known['frame'] = round(first, 6), frame.hex()
+    for (key, _), change in changes.items():
+        results.setdefault(key[:3], []).append(change)
+    for key, (count, common, varies) in baseline.types.items():
+        expected = baseline.rate(key) * event.seconds
+        seen = event.types[key][0] if key in event.types else 0
+        if expected >= min_missing and seen < expected - sigma * math.sqrt(expected):
+            results.setdefault(key[:3], []).append({
+                'change': 'missing', 'frame': common.hex(), 'count': seen, 'expected': round(expected, 2),
+                'type_count': seen, 'first': None, 'reference': None, 'positions': None})
+    for changes in results.values():
+        changes.sort(key=lambda change: (change['first'] is None, change['first'] or 0))
+    return dict(sorted(results.items(), key=lambda item: min(change['first'] if change['first'] is not None
+                                                             else math.inf for change in item[1])))
+
+
+def print_changes(results):
+    for (sender, receiver, opcode), changes in results.items():
+        opcode = f'x{opcode:02x}' if opcode is not None else '--'
+        print(f'{sender:02x} -> {receiver:02x} {opcode}')
+        for change in changes:
+            frame = bytes.fromhex(change['frame'])
+            positions = change['positions'] or ()
+            marked = ' '.join(f'[{byte:02x}]' if i in positions else f'{byte:02x}' for i, byte in enumerate(frame))
+            when = f"{change['first']:10.3f} s" if change['first'] is not None else ' ' * 12
+            counts = f"{change['count']:5d}x of {change['type_count']:5d} (expected {change['expected']:g})"
+            print(f"  {change['change']:7s} {when}  {counts}  {marked}")
+            if change['reference']:
+                print(f"  {'':7s} {'':12s}  {'was':>{len(counts)}s}  {' '.join(f'{byte:02x}' for byte in bytes.fromhex(change['reference']))}")
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    from time import perf_counter
+    parser = argparse.ArgumentParser(description='Frames that differ between a baseline capture and an event capture')
+    parser.add_argument('baseline', help='capture with no button presses (capture.py)')
+    parser.add_argument('event', help='capture around the button press')
+    parser.add_argument('--start', type=float, help='only use the event capture from this many seconds in')
+    parser.add_argument('--end', type=float, help='only use the event capture up to this many seconds in')
+    parser.add_argument('--sigma', type=float, default=3.0, help='how unusual a count has to be to report it')
+    parser.add_argument('--json', metavar='FILE', help='also write the changes as JSON')
+    args = parser.parse_args()
+    began = perf_counter()
+    baseline = INDEX(args.baseline)
+    event = INDEX(args.event, args.start, args.end)
+    results = compare(baseline, event, args.sigma)
+    print_changes(results)
+    print(f'{baseline.frames:,} baseline and {event.frames:,} event frames '
+          f'({len(baseline.types):,} and {len(event.types):,} frame types) compared in {perf_counter() - began:.2f} sec')
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump([{'sender': sender, 'receiver': receiver, 'opcode': opcode, 'changes': changes}
+                       for (sender, receiver, opcode), changes in results.items()], file, indent=2)
@@ -0,0 +1,216 @@
+'''
+ERV bus broker daemon that owns the RS485 serial port and serves
+clients over a Unix socket, so several tools never fight over the tty.
+
+Each request and reply is one line of JSON:
+  {"request": "command", "command": "standby", "priority": 10}
+  {"request": "state"}      <-- Last confirmed command and the mode the ERV reports on the bus
+  {"request": "telemetry"}  <-- Latest register values decoded from the bus
+  {"request": "commands"}   <-- Valid commands for this wall control type
+  {"request": "subscribe"}  <-- Stream every frame seen on the bus
+
+Commands run one at a time in priority order (lower number first).
+A command supersedes any queued command of the same or lower priority
+that has not been sent yet (i.e. three mode changes inside one ~18 ms
+polling cycle), so only the last one is written to the bus and every
+client waiting on them gets the result of that command.
+
+Command-line Usage:
+  python3 ervd.py /dev/ttyUSB0 vautow
+  python3 ervd.py /dev/ttyUSB0 vttouchw /tmp/ervd.sock
+  python3 ervd.py /dev/ttyUSB0 vautow --metrics 9108            <-- Prometheus metrics (see metrics.py)
+  python3 ervd.py /dev/ttyUSB0 vautow --metrics-file erv.prom   <-- Rewritten every metrics_interval seconds
+
+Once the daemon is running, vautow.py and vttouchw.py send their
+commands through it instead of opening the serial port.
+'''
+
+import heapq
+import json
+import os
+import socket
+from time import time
+
+SOCKET = os.environ.get('ERVD_SOCKET', '/tmp/ervd.sock')
+
+def request(message, path=SOCKET, timeout=30):
+    '''
+    Send one request to a running daemon and return the JSON reply,
+    or None if no daemon is listening on the socket. A daemon that does
+    not answer in time or answers with something that is not JSON gives
+    an error reply ({'ok': False, 'error': ...}).
+    '''
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(path)
+            client.sendall(json.dumps(message).encode() + b'\n')
+            with client.makefile('rb') as reply:
+                return json.loads(reply.readline())
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    except (OSError, ValueError) as e:  # Timed out, connection dropped or no JSON (empty line)
+        return {'ok': False, 'error': f'no reply from ervd on {path} ({e!r})'}
+
+
+class ERVD:
+    def __init__(self,port='/dev/ttyUSB0',device='vautow',path=SOCKET,metrics_port=None,metrics_file=None):
+        from aiobus import AIOBUS, AIOVAUTOW, AIOVTTOUCHW
+        from vautow import NAMES as VAUTOW_NAMES
+        from vttouchw import NAMES as VTTOUCHW_NAMES
+        self.port = port
+        self.device = device
+        self.path = path
+        self.bus = AIOBUS(port)
+        self.erv = {'vautow': AIOVAUTOW, 'vttouchw': AIOVTTOUCHW}[device](bus=self.bus)
+        self.names = {'vautow': VAUTOW_NAMES, 'vttouchw': VTTOUCHW_NAMES}[device]
+        self.coalesce_window = 0.018  # One ERV polling cycle
+        self.queue = []       # Heap of (priority, sequence, {'command','waiters'}) not sent yet
+        self.queued = None
+        self.sequence = 0
+        self.state = {'state': None, 'status': None, 'time': None}
+        self.coalesced = 0
+        self.metrics = None
+        if metrics_port or metrics_file:
+            from metrics import METRICS
+            self.metrics = METRICS().watch(self.bus)
+        self.metrics_port = metrics_port
+        self.metrics_file = metrics_file
+        self.metrics_interval = 15
+
+    async def serve(self):
+        import asyncio
+        self.queued = asyncio.Event()
+        await self.bus.connect()
+        if self.metrics_port:
+            self.metrics.serve(self.metrics_port)
+        if self.metrics_file:
+            asyncio.create_task(self.export())
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # Left over from a daemon that did not exit cleanly
+        server = await asyncio.start_unix_server(self.client, path=self.path)
+        print(f'ervd: {self.device} on {self.port} listening on {self.path}')
+        try:
+            async with server:
+                await asyncio.gather(server.serve_forever(), self.worker())
+        finally:
+            self.bus.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def export(self):
+        '''Rewrite metrics_file every metrics_interval seconds.'''
+        import asyncio
+        while True:
+            try:
+                self.metrics.write(self.metrics_file)
+            except OSError as e:
+                print(f'ervd: cannot write {self.metrics_file} ({e})')
+            await asyncio.sleep(self.metrics_interval)
+
+    async def client(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                try:
+                    message = json.loads(line)
+                    kind = message.get('request', 'command')
+                    if message.get('port', self.port) != self.port:  # The client may open that port itself
+                        reply = {'ok': False, 'elsewhere': True, 'error': f'ervd is running {self.device} on {self.port}'}
+                    elif message.get('device', self.device) != self.device:  # This port is ours, do not let the client open it
+                        reply = {'ok': False, 'error': f"ervd is running {self.device} on {self.port}, not {message['device']}"}
+                    elif kind == 'command':
+                        reply = await self.submit(message['command'].lower(), message.get('priority', 10))
+                    elif kind == 'state':
+                        code = self.bus.tracker.current(self.erv.max_age)
+                        reply = dict(self.state, mode=self.names.get(code, code), ok=True)
+                    elif kind == 'telemetry':
+                        reply = dict(self.bus.telemetry.snapshot.as_dict(), ok=True)
+                    elif kind == 'commands':
+                        reply = {'ok': True, 'commands': list(self.erv.command_list)}
+                    elif kind == 'subscribe':
+                        return await self.subscribe(writer)
+                    else:
+                        reply = {'ok': False, 'error': f'{kind} request not found'}
+                except (ValueError, KeyError, AttributeError) as e:
+                    reply = {'ok': False, 'error': f'bad request ({e})'}
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass  # Client went away
+        finally:
+            writer.close()
+
+    async def subscribe(self, writer):
+        '''Stream every bus frame to the client until it disconnects.'''
+        async for frame in self.bus.watch():
+            writer.write(json.dumps({
+                'time': time(),
+                'frame': frame.hex(),
+                'sender': frame[1],
+                'receiver': frame[2],
+                'message': frame[5:-2].hex()}).encode() + b'\n')
+            await writer.drain()
+
+    async def submit(self, command, priority):
+        '''
+        Queue a command. It supersedes every queued command that has not been
+        sent yet and is not more important (lower priority number) than it.
+        '''
+        import asyncio
+        if command not in self.erv.command_list:
+            return {'ok': False, 'error': f'{command} command not found'}
+        waiter = asyncio.get_running_loop().create_future()
+        waiters = [waiter]
+        keep = []
+        for entry in self.queue:
+            if entry[0] >= priority:
+                waiters += entry[2]['waiters']  # Superseded, only the last mode change is sent
+                self.coalesced += 1
+            else:
+                keep.append(entry)
+        self.sequence += 1
+        keep.append((priority, self.sequence, {'command': command, 'waiters': waiters}))
+        heapq.heapify(keep)
+        self.queue = keep
+        self.queued.set()
+        return await waiter
+
+    async def worker(self):
+        import asyncio
+        while True:
+            await self.queued.wait()
+            await asyncio.sleep(self.coalesce_window)  # Let superseding commands arrive
+            priority, sequence, pending = heapq.heappop(self.queue)
+            if not self.queue:
+                self.queued.clear()
+            started = time()
+            try:
+                await getattr(self.erv, pending['command'])()
+                ok = self.erv.status.endswith('OK')
+                reply = {'ok': ok, 'command': pending['command'], 'status': self.erv.status}
+                if ok:
+                    self.state = {'state': self.erv.state, 'status': self.erv.status, 'time': time()}
+            except Exception as e:  # Keep serving other clients
+                reply = {'ok': False, 'command': pending['command'], 'error': str(e)}
+            reply['seconds'] = round(time() - started, 4)
+            reply['coalesced'] = len(pending['waiters']) - 1
+            for waiter in pending['waiters']:
+                if not waiter.done():
+                    waiter.set_result(reply)
+
+
+if __name__ == '__main__':
+    import sys
+    import asyncio
+    option = lambda name: sys.argv[sys.argv.index(name) + 1] if name in sys.argv else None
+    metrics_port, metrics_file = option('--metrics'), option('--metrics-file')
+    arguments = [arg for arg in sys.argv[1:] if arg not in ('--metrics', '--metrics-file', metrics_port, metrics_file)]
+    if len(arguments) < 2 or arguments[1].lower() not in ('vautow', 'vttouchw'):
+        print('Example command-line: python3 ervd.py /dev/ttyUSB0 vautow')
+    else:
+        daemon = ERVD(arguments[0], arguments[1].lower(), *arguments[2:3],
+                      metrics_port=int(metrics_port) if metrics_port else None, metrics_file=metrics_file)
+        try:
+            asyncio.run(daemon.serve())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,124 @@
+'''
+Send one command to several ERV/HRVs at the same time, each on its own
+USB-to-RS485 adapter, so a building-wide standby takes as long as the
+slowest unit instead of the sum of all of them.
+
+Every unit gets its own AIOBUS on one asyncio event loop, and the
+commands run concurrently with a timeout per unit. A unit whose port is
+owned by a running ervd.py daemon is sent the command through the
+daemon instead. Each unit reports its own result and timing:
+  {'port': '/dev/ttyUSB0', 'device': 'vautow', 'command': 'standby',
+   'status': '..OK', 'ok': True, 'seconds': 0.052, 'error': None}
+
+Command-line Usage:
+  python3 fleet.py standby /dev/ttyUSB0=vautow /dev/ttyUSB1=vttouchw
+  python3 fleet.py standby /dev/ttyUSB0=vautow /dev/ttyUSB1=vttouchw --json
+
+Module import usage in script:
+  from fleet import FLEET
+  from vautow import VAUTOW
+  from vttouchw import VTTOUCHW
+  fleet = FLEET({'/dev/ttyUSB0': VAUTOW, '/dev/ttyUSB1': 'vttouchw'})
+  fleet.command('standby')    <-- List of per-unit results
+  fleet.report(results)
+'''
+
+import asyncio
+from time import perf_counter
+
+DEVICES = ('vautow', 'vttouchw')
+
+class FLEET:
+    def __init__(self, units, timeout=5.0, use_daemon=True):
+        from vautow import VAUTOW
+        from vttouchw import VTTOUCHW
+        classes = {VAUTOW: 'vautow', VTTOUCHW: 'vttouchw'}
+        self.units = {}  # port -> 'vautow' or 'vttouchw'
+        for port, device in units.items():
+            device = classes.get(device, device)
+            if device not in DEVICES:
+                raise ValueError(f'{port}: unknown device {device!r}, expected one of {DEVICES}')
+            self.units[port] = device
+        self.timeout = timeout        # Seconds allowed per unit (open + every attempt)
+        self.use_daemon = use_daemon  # Send through ervd.py when it owns the port
+
+    def command(self, command):
+        '''
+        Send command to every unit at once. Returns one result per unit, in port order.
+        '''
+        return asyncio.run(self.run(command))
+
+    async def run(self, command):
+        '''Coroutine version of command(), for callers with their own event loop.'''
+        return list(await asyncio.gather(*(self.unit(port, device, command)
+                                           for port, device in self.units.items())))
+
+    async def unit(self, port, device, command):
+        result = {'port': port, 'device': device, 'command': command,
+                  'status': None, 'ok': False, 'seconds': None, 'error': None}
+        began = perf_counter()
+        try:
+            result['status'] = await asyncio.wait_for(self._send(port, device, command), self.timeout)
+        except asyncio.TimeoutError:
+            result['error'] = f'no result after {self.timeout} seconds'
+        except Exception as e:  # Bad command, missing port, daemon error
+            result['error'] = str(e) or repr(e)
+        result['seconds'] = perf_counter() - began
+        result['ok'] = bool(result['status']) and result['status'].endswith('OK')
+        return result
+
+    async def _send(self, port, device, command):
+        if self.use_daemon:
+            from ervd import request
+            reply = await asyncio.to_thread(request, {'request': 'command', 'port': port,
+                                                      'device': device, 'command': command},
+                                            timeout=self.timeout)
+            if reply is not None and not reply.get('elsewhere'):
+                if reply.get('error'):
+                    raise RuntimeError(reply['error'])
+                return reply.get('status')
+        from aiobus import AIOVAUTOW, AIOVTTOUCHW
+        erv = {'vautow': AIOVAUTOW, 'vttouchw': AIOVTTOUCHW}[device](port)
+        if command.lower() not in erv.command_list:
+            raise ValueError(f'{command} command not found')
+        try:
+            await erv.send_frames(command.lower())
+        finally:
+            erv.bus.close()
+        return erv.status
+
+    @staticmethod
+    def report(results):
+        '''
+        Print one line per unit and the total time (the slowest unit).
+        '''
+        for result in results:
+            outcome = result['status'] or f"FAILED ({result['error']})"
+            print(f"{result['port']:16s} {result['device']:8s} {result['command']:10s} "
+                  f"{result['seconds'] * 1000:7.1f} ms  {outcome}")
+        if results:
+            slowest = max(result['seconds'] for result in results)
+            ok = sum(result['ok'] for result in results)
+            print(f'{ok}/{len(results)} OK in {slowest * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import sys
+    parser = argparse.ArgumentParser(description='Send one command to several ERV/HRVs at the same time')
+    parser.add_argument('command', help='i.e. standby')
+    parser.add_argument('units', nargs='+', metavar='PORT=DEVICE', help='i.e. /dev/ttyUSB0=vautow')
+    parser.add_argument('--timeout', type=float, default=5.0, help='seconds allowed per unit')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+    try:
+        fleet = FLEET(dict(unit.rsplit('=', 1) for unit in args.units), timeout=args.timeout)
+    except ValueError as e:
+        parser.error(e)
+    results = fleet.command(args.command)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        FLEET.report(results)
+    sys.exit(0 if all(result['ok'] for result in results) else 1)
@@ -0,0 +1,218 @@
+'''
+RS485 frame parsing shared by the VAUTOW and VTTOUCHW scripts.
+
+RS485 Protcol Encoding in bytes (see notes_vautow.txt):
+  01  Frame Start
+  Tx  Sender ID
+  Rx  Receiver ID
+  01  ??? All frames have 01 here
+  LL  Message Length in Bytes
+  MM  Message (LL bytes)
+  CS  Check Sum (byte sum from Tx through CS is always 00)
+  04  Frame End
+
+Frames are found with the LL length byte instead of splitting on x04,
+so a x04 inside the message (Turbo frame, VTTOUCHW telemetry frame)
+no longer tears a frame in half.
+
+Module import usage in script:
+  from frames import PARSER, build
+  parser = PARSER()
+  for frame in parser.feed(ser.read(ser.in_waiting or 1)):
+      print(frame.hex())
+  build(0x10, 0x11, bytes.fromhex('20 01 20'))  <-- b'\x01\x10\x11\x01\x03\x20\x01\x20\x9a\x04'
+
+Throughput benchmark:
+  python3 frames.py
+
+Print the VTTOUCHW command table for micropython/vttouchw.py:
+  python3 frames.py micropython
+'''
+
+START = 0x01
+END = 0x04
+HEADER = 5     # Start, Tx, Rx, 01, LL
+OVERHEAD = 7   # HEADER + Check Sum + End
+MAX_FRAME = OVERHEAD + 0xff
+
+
+def build(sender, receiver, message):
+    '''
+    Build a complete frame, adding the LL length byte and Check Sum.
+    '''
+    body = bytes((sender, receiver, 0x01, len(message))) + bytes(message)
+    return bytes((START,)) + body + bytes((-sum(body) & 0xff, END))
+
+
+class FRAME:
+    '''
+    Zero-copy view of one complete frame inside the PARSER buffer.
+    Only valid until the next PARSER.feed() call, use bytes(frame) to keep it.
+    '''
+    __slots__ = ('view',)
+
+    def __init__(self, view):
+        self.view = view
+
+    def __len__(self):
+        return len(self.view)
+
+    def __bytes__(self):
+        return self.view.tobytes()
+
+    def __getitem__(self, index):
+        return self.view[index]
+
+    def hex(self):
+        return self.view.hex()
+
+    @property
+    def sender(self):
+        return self.view[1]
+
+    @property
+    def receiver(self):
+        return self.view[2]
+
+    @property
+    def length(self):
+        return self.view[4]
+
+    @property
+    def message(self):
+        return self.view[HEADER:-2]
+
+    @property
+    def opcode(self):
+        '''First message byte (x20 read, x21 read response, x40 write, x41 write response)'''
+        return self.view[HEADER] if self.view[4] else None
+
+    @property
+    def checksum(self):
+        return self.view[-2]
+
+
+class PARSER:
+    '''
+    Incremental frame parser over a preallocated bytearray.
+    Bytes go in with feed() and complete, checksum-valid frames come out.
+    Memory use is fixed at the buffer size no matter how long it runs.
+    '''
+    def __init__(self, size=4096):
+        if size < 2 * MAX_FRAME:
+            raise ValueError(f'buffer size must be at least {2 * MAX_FRAME} bytes')
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0      # First unparsed byte in buffer
+        self.end = 0        # One past the last received byte in buffer
+        self.frames = 0     # Valid frames found
+        self.errors = 0     # Frames rejected by Check Sum or Frame End
+        self.discarded = 0  # Bytes thrown away while looking for Frame Start
+        self.received = 0   # Bytes fed in
+
+    def reset(self):
+        '''Drop any partial frame (i.e. after reopening the serial port).'''
+        self.start = self.end = 0
+
+    def feed(self, data):
+        '''
+        Add received bytes and yield each complete FRAME.
+        '''
+        data = memoryview(data)
+        self.received += len(data)
+        while data:
+            self._compact()
+            count = min(len(data), len(self.buffer) - self.end)
+            self.view[self.end:self.end + count] = data[:count]
+            self.end += count
+            data = data[count:]
+            yield from self._parse()
+
+    def _compact(self):
+        '''Move the unparsed tail to the front of the buffer.'''
+        if self.start:
+            remaining = self.end - self.start
+            self.buffer[:remaining] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = remaining
+
+    def _parse(self):
+        buffer = self.buffer
+        view = self.view
+        while self.end - self.start >= OVERHEAD:
+            position = self.start
+            if buffer[position] != START:
+                found = buffer.find(START, position, self.end)
+                if found < 0:
+                    found = self.end
+                self.discarded += found - position
+                self.start = found
+                continue
+            last = position + buffer[position + 4] + OVERHEAD - 1
+            if last >= self.end:
+                return  # Wait for the rest of the frame
+            if buffer[last] != END or buffer[position + 3] != 0x01 or sum(view[position + 1:last]) & 0xff:
+                self.errors += 1
+                self.discarded += 1
+                self.start = position + 1  # Not a frame, resync on the next x01
+                continue
+            self.frames += 1
+            self.start = last + 1
+            yield FRAME(view[position:last + 1])
+
+
+# Recorded mix of VAUTOW/VTTOUCHW frames (polls, commands, responses) for benchmarks
+SAMPLES = (
+    '011011010104d904', '011110010105d804',
+    '01101101084000220440380000f804', '0111100105210120010c8a04',
+    '0110110112400320000822049a99e3420622049a99e3425f04',
+    '01101201094000200111082001003904', '011210010541082000204f04',
+    '01121001092102200111002001015d04',
+    )
+
+
+def benchmark(seconds=2.0, chunk=64):
+    '''
+    Feed the SAMPLES mix of VAUTOW/VTTOUCHW frames through PARSER and
+    compare the parse rate with a saturated 38400 baud bus (3840 bytes/sec).
+    '''
+    from time import perf_counter
+    stream = bytes.fromhex(''.join(SAMPLES)) * 512
+    expected = len(SAMPLES) * 512
+    parser = PARSER()
+    total_bytes = total_frames = 0
+    began = perf_counter()
+    while perf_counter() - began < seconds:
+        for i in range(0, len(stream), chunk):
+            for frame in parser.feed(stream[i:i + chunk]):
+                total_frames += 1
+        total_bytes += len(stream)
+    elapsed = perf_counter() - began
+    rate = total_bytes / elapsed
+    print(f'{total_frames} frames, {total_bytes} bytes in {elapsed:.2f} sec')
+    print(f'{total_frames / elapsed:,.0f} frames/sec  {rate:,.0f} bytes/sec  ({rate / 3840:,.0f}x a saturated 38400 baud bus)')
+    print(f'errors: {parser.errors}  discarded: {parser.discarded}  expected frames per pass: {expected}')
+    return rate
+
+
+def micropython_table():
+    '''
+    VTTOUCHW command table as frozen bytes constants for MicroPython,
+    which cannot afford to build the table on the ESP32 at boot.
+    '''
+    from vttouchw import FRAMES
+    literal = lambda frame: "b'" + ''.join(f'\\x{byte:02x}' for byte in frame) + "'"
+    lines = ['FRAMES = {  # Generated by: python3 frames.py micropython']
+    for command, (tx, rx) in FRAMES.items():
+        lines.append(f"    '{command}': {literal(tx[0])},")
+    lines.append('    }')
+    lines.append(f'RX1 = {literal(rx)}  # Same ERV response for all control commands')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:] == ['micropython']:
+        print(micropython_table())
+    else:
+        benchmark()
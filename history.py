@@ -0,0 +1,178 @@
+'''
+Fixed-size history of decoded bus telemetry (mode changes, register
+values, the VAUTOW 10 second counter) that never grows in memory.
+
+Each field has three ring buffers of float64 records:
+  raw     (time, value)                    ~3 days of 3 second samples
+  minute  (time, min, max, mean, count)    2 weeks
+  hour    (time, min, max, mean, count)    ~1 year
+Every raw sample also goes into the min/max/mean of the current minute
+and hour, which are appended to their rings when the minute or hour ends.
+With a directory the rings live in memory-mapped files, so a restart
+picks up where it left off without loading anything. The minute and
+hour still being filled are kept in memory and are lost on a restart.
+
+Module import usage in script:
+  from history import HISTORY
+  history = HISTORY('erv_history')      <-- HISTORY() keeps it in memory only
+  history.watch(bus.telemetry)           <-- Record every decoded field
+  history.add('mode', time(), 9)
+  history.query('mode', start, end)               <-- [(time, value), ...]
+  history.query('float_2208', start, end, 'hour') <-- [(time, min, max, mean, count), ...]
+'''
+
+import mmap
+import os
+import struct
+
+HEADER = struct.Struct('<8sQQQQ')  # Magic, capacity, width, next slot, count
+HEADER_SIZE = 64
+MAGIC = b'ERVRING1'
+
+TIERS = (
+    ('raw', 2, 100000, None),       # (name, record width, capacity, seconds per record)
+    ('minute', 5, 20160, 60),
+    ('hour', 5, 8760, 3600),
+    )
+
+
+class RING:
+    '''
+    Ring buffer of fixed-width float64 records in time order.
+    '''
+    def __init__(self, capacity, width, path=None):
+        size = HEADER_SIZE + capacity * width * 8
+        self.capacity = capacity
+        self.width = width
+        self.record = struct.Struct(f'{width}d')
+        self.file = None
+        if path is None:
+            self.memory = bytearray(size)
+        else:
+            new = not os.path.exists(path) or os.path.getsize(path) != size
+            self.file = open(path, 'w+b' if new else 'r+b')
+            if new:
+                self.file.truncate(size)
+            self.memory = mmap.mmap(self.file.fileno(), size)
+        magic, capacity, width, self.next, self.count = HEADER.unpack_from(self.memory)
+        if magic != MAGIC or capacity != self.capacity or width != self.width:
+            self.next = self.count = 0  # New file (or a different layout), start empty
+        self.data = memoryview(self.memory)[HEADER_SIZE:].cast('d')
+
+    def close(self):
+        HEADER.pack_into(self.memory, 0, MAGIC, self.capacity, self.width, self.next, self.count)
+        self.data.release()
+        if self.file is not None:
+            self.memory.close()
+            self.file.close()
+            self.file = None
+
+    def append(self, record):
+        self.record.pack_into(self.memory, HEADER_SIZE + self.next * self.record.size, *record)
+        self.next = (self.next + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        HEADER.pack_into(self.memory, 0, MAGIC, self.capacity, self.width, self.next, self.count)
+
+    def time(self, index):
+        '''Time of the index-th oldest record.'''
+        return self.data[((self.next - self.count + index) % self.capacity) * self.width]
+
+    def bisect(self, moment):
+        '''Index of the first record at or after moment.'''
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.time(middle) < moment:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, start, end):
+        '''Records with start <= time < end, oldest first.'''
+        first, last = self.bisect(start), self.bisect(end)
+        oldest = self.next - self.count
+        unpack, size, memory = self.record.unpack_from, self.record.size, self.memory
+        return [unpack(memory, HEADER_SIZE + ((oldest + index) % self.capacity) * size)
+                for index in range(first, last)]
+
+
+class BUCKET:
+    '''Min/max/mean of the samples in the current minute or hour.'''
+    __slots__ = ('start', 'low', 'high', 'total', 'count')
+
+    def __init__(self, start):
+        self.start = start
+        self.low = float('inf')
+        self.high = float('-inf')
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, value):
+        if value < self.low:
+            self.low = value
+        if value > self.high:
+            self.high = value
+        self.total += value
+        self.count += 1
+
+    def record(self):
+        return (self.start, self.low, self.high, self.total / self.count, self.count)
+
+
+class HISTORY:
+    def __init__(self, directory=None):
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.fields = {}   # Field -> {tier name: RING}
+        self.buckets = {}  # (field, tier name) -> BUCKET being filled
+
+    def close(self):
+        for rings in self.fields.values():
+            for ring in rings.values():
+                ring.close()
+        self.fields = {}
+
+    def rings(self, field):
+        rings = self.fields.get(field)
+        if rings is None:
+            rings = {}
+            for name, width, capacity, seconds in TIERS:
+                path = None if self.directory is None else os.path.join(self.directory, f'{field}.{name}')
+                rings[name] = RING(capacity, width, path)
+            self.fields[field] = rings
+        return rings
+
+    def add(self, field, moment, value):
+        '''
+        Record one sample and roll it up into the minute and hour rings.
+        '''
+        rings = self.rings(field)
+        value = float(value)
+        rings['raw'].append((moment, value))
+        for name, width, capacity, seconds in TIERS[1:]:
+            start = moment - moment % seconds
+            bucket = self.buckets.get((field, name))
+            if bucket is not None and bucket.start != start:
+                rings[name].append(bucket.record())  # Bucket finished
+                bucket = None
+            if bucket is None:
+                bucket = self.buckets[(field, name)] = BUCKET(start)
+            bucket.add(value)
+
+    def query(self, field, start, end, tier='raw'):
+        '''
+        Records for a field between start and end (seconds since the epoch).
+        The minute and hour still being filled are not included.
+        '''
+        if field not in self.fields:
+            if self.directory is None or not os.path.exists(os.path.join(self.directory, f'{field}.raw')):
+                return []
+        return self.rings(field)[tier].query(start, end)
+
+    def watch(self, telemetry):
+        '''Record every field the telemetry decoder updates.'''
+        telemetry.watchers.append(self.add)
+        return self
@@ -0,0 +1,209 @@
+'''
+Offline UART decoder for logic analyzer captures of the RS485 D+ wire
+(sigrok/PulseView, see PulseView_RS485_VAUTOW.png), so long captures
+can be turned into timestamped frames from a script instead of the
+PulseView UART decoder.
+
+Samples are decoded with NumPy, without a Python loop per sample:
+  1. Falling edges of the line are found with one vectorized compare
+  2. Start bits are chosen among the edges by jumping one character
+     (10 bits at 38400 baud, 8N1) ahead with searchsorted, and the
+     chain of characters is followed by pointer doubling
+  3. The middle of every data and stop bit is sampled for all
+     characters at once
+The bytes then go through frames.PARSER, and each frame gets the time
+of its first byte from the capture.
+
+Capture formats:
+  .sr     sigrok session (PulseView File > Save), sample rate and
+          channel names are read from its metadata
+  .csv    sigrok CSV export (optional ; comment lines and header row,
+          one column per channel, --samplerate required)
+  other   raw binary export, one unsigned byte (or --unitsize bytes)
+          per sample, --samplerate required
+
+Command-line Usage:
+  python3 logic.py vautow.sr                                  <-- Frames with timestamps
+  python3 logic.py vautow.sr --channel D1 --invert            <-- D- wire on D1
+  python3 logic.py capture.bin --samplerate 1000000 --record erv.cap
+
+Module import usage in script:
+  from logic import load, decode_uart, decode
+  samples, samplerate, channels = load('vautow.sr')
+  times, values, errors = decode_uart(samples & 1, samplerate)
+  for seconds, frame in decode('vautow.sr'):
+      print(f'{seconds:.6f} {frame.hex()}')
+'''
+
+import configparser
+import zipfile
+import numpy as np
+from frames import PARSER
+
+BAUDRATE = 38400
+UNIT = {'': 1, 'k': 10**3, 'm': 10**6, 'g': 10**9}
+DTYPES = {1: '<u1', 2: '<u2', 4: '<u4', 8: '<u8'}
+
+
+def samplerate_value(text):
+    '''sigrok sample rate strings: "1 MHz", "500 kHz", "24000000" -> Hz'''
+    text = text.strip().lower().removesuffix('hz').strip()
+    prefix = text[-1:] if text[-1:] in UNIT and not text[-1:].isdigit() else ''
+    return int(float(text[:len(text) - len(prefix)]) * UNIT[prefix])
+
+
+def load_sr(path):
+    '''
+    Samples, sample rate and {channel name: bit} from a sigrok .sr session.
+    '''
+    with zipfile.ZipFile(path) as archive:
+        metadata = configparser.ConfigParser(interpolation=None)
+        metadata.read_string(archive.read('metadata').decode())
+        device = metadata['device 1']
+        prefix = device.get('capturefile', 'logic-1')
+        unitsize = device.getint('unitsize', 1)
+        # Samples are split into logic-1-1, logic-1-2, ... (or one logic-1 file in old versions)
+        chunks = sorted((name for name in archive.namelist() if name == prefix or name.startswith(prefix + '-')),
+                        key=lambda name: int(name[len(prefix) + 1:] or 0))
+        data = b''.join(archive.read(name) for name in chunks)
+    channels = {value: int(key[5:]) - 1 for key, value in device.items() if key.startswith('probe') and key[5:].isdigit()}
+    return np.frombuffer(data, DTYPES[unitsize]), samplerate_value(device['samplerate']), channels
+
+
+def load_csv(path):
+    '''
+    Samples (channel columns packed into bits, first column = bit 0) and
+    {channel name: bit} from a CSV export.
+    '''
+    with open(path) as file:
+        lines = [line for line in file if line.strip() and not line.startswith((';', '#'))]
+    first = lines[0].split(',')
+    try:
+        float(first[0])
+        names = [f'D{bit}' for bit in range(len(first))]
+    except ValueError:  # Header row with the channel names
+        names = [name.strip() for name in first]
+        lines = lines[1:]
+    columns = np.loadtxt(lines, delimiter=',', dtype=np.float64, ndmin=2) != 0
+    weights = np.left_shift(1, np.arange(columns.shape[1], dtype=np.uint64))
+    return (columns @ weights).astype(np.uint64), dict(zip(names, range(len(names))))
+
+
+def load(path, samplerate=None, unitsize=1):
+    '''
+    (samples, samplerate, channels) from a .sr, .csv or raw binary capture.
+    samples holds one bit per channel, channels maps channel names to bits.
+    '''
+    if path.endswith('.sr'):
+        samples, rate, channels = load_sr(path)
+        return samples, samplerate or rate, channels
+    if samplerate is None:
+        raise ValueError(f'{path}: --samplerate is required for CSV and raw captures')
+    if path.endswith('.csv'):
+        samples, channels = load_csv(path)
+    else:
+        samples = np.fromfile(path, DTYPES[unitsize])
+        channels = {f'D{bit}': bit for bit in range(8 * unitsize)}
+    return samples, samplerate, channels
+
+
+def line(samples, channels, channel='D0', invert=False):
+    '''Boolean line level (True = idle/mark) of one channel.'''
+    bit = channels[channel] if channel in channels else int(channel)
+    level = (samples >> samples.dtype.type(bit)) & 1 == 1
+    return ~level if invert else level
+
+
+def decode_uart(level, samplerate, baudrate=BAUDRATE):
+    '''
+    Decode 8N1 UART characters from a boolean line level array.
+    Returns (times in seconds, byte values as uint8, framing error flags).
+    '''
+    bit = samplerate / baudrate  # Samples per bit
+    if bit < 3:
+        raise ValueError(f'{samplerate} samples/sec is too slow for {baudrate} baud')
+    level = np.asarray(level, dtype=bool)
+    # Every falling edge is a possible start bit
+    edges = np.flatnonzero(level[:-1] & ~level[1:]) + 1
+    edges = edges[edges + int(9.5 * bit) < len(level)]  # Whole character inside the capture
+    count = len(edges)
+    if not count:
+        return np.empty(0), np.empty(0, np.uint8), np.empty(0, bool)
+    # Next start bit after each character: first edge after the middle of its stop bit
+    jump = np.append(np.searchsorted(edges, edges + 9.5 * bit), count)
+    # Characters are the edges reachable from the first one (pointer doubling,
+    # log2(count) vectorized steps instead of a loop per character)
+    reached = np.zeros(1, dtype=np.intp)
+    while True:
+        ahead = jump[reached]
+        if (ahead == count).all():
+            break
+        reached = np.union1d(reached, ahead[ahead < count])
+        jump = jump[jump]
+    starts = edges[reached]
+    # Sample the middle of the start bit, 8 data bits (LSB first) and the stop bit
+    offsets = ((np.arange(10) + 0.5) * bit).astype(np.intp)
+    bits = level[starts[:, None] + offsets]
+    values = (bits[:, 1:9] @ (1 << np.arange(8))).astype(np.uint8)
+    errors = bits[:, 0] | ~bits[:, 9]  # Start bit not low or stop bit not high (glitch, collision)
+    return starts / samplerate, values, errors
+
+
+def frames(times, values, chunk=4096):
+    '''
+    Yield (seconds, FRAME) for every valid frame in the decoded bytes.
+    The FRAME is only valid until the next one is yielded (see PARSER).
+    '''
+    parser = PARSER()
+    data = values.tobytes()
+    done = 0  # Bytes in frames already yielded
+    for i in range(0, len(data), chunk):
+        for frame in parser.feed(data[i:i + chunk]):
+            # Every byte before this frame was in an earlier frame or discarded by the parser
+            yield float(times[done + parser.discarded]), frame
+            done += len(frame)
+
+
+def decode(path, channel='D0', invert=False, samplerate=None, unitsize=1, baudrate=BAUDRATE):
+    '''
+    Yield (seconds, FRAME) for every frame in a capture file.
+    '''
+    samples, samplerate, channels = load(path, samplerate, unitsize)
+    times, values, errors = decode_uart(line(samples, channels, channel, invert), samplerate, baudrate)
+    yield from frames(times, values)
+
+
+if __name__ == '__main__':
+    import argparse
+    from time import perf_counter
+    parser = argparse.ArgumentParser(description='Decode RS485 frames from a logic analyzer capture')
+    parser.add_argument('capture', help='.sr, .csv, or raw binary samples')
+    parser.add_argument('--channel', default='D0', help='channel name or bit number of the D+ wire')
+    parser.add_argument('--invert', action='store_true', help='the channel is the D- wire (idle low)')
+    parser.add_argument('--samplerate', type=samplerate_value, help='i.e. 1MHz (read from .sr files)')
+    parser.add_argument('--unitsize', type=int, default=1, choices=sorted(DTYPES), help='bytes per raw sample')
+    parser.add_argument('--baudrate', type=int, default=BAUDRATE)
+    parser.add_argument('--record', metavar='FILE', help='write the frames to a capture.py file')
+    args = parser.parse_args()
+    began = perf_counter()
+    try:
+        samples, samplerate, channels = load(args.capture, args.samplerate, args.unitsize)
+    except ValueError as e:
+        parser.error(e)
+    times, values, errors = decode_uart(line(samples, channels, args.channel, args.invert), samplerate, args.baudrate)
+    recorder = None
+    if args.record:
+        from capture import RECORDER
+        recorder = RECORDER(args.record)
+    count = 0
+    for seconds, frame in frames(times, values):
+        if recorder:
+            recorder.write(frame, round(seconds * 1e9))
+        else:
+            print(f'{seconds * 1000:12.3f} ms  {frame.hex()}')
+        count += 1
+    if recorder:
+        recorder.close()
+    elapsed = perf_counter() - began
+    print(f'{len(samples):,} samples at {samplerate:,} Hz, {len(values):,} bytes '
+          f'({int(errors.sum())} framing errors), {count:,} frames in {elapsed:.2f} sec')
@@ -0,0 +1,180 @@
+'''
+Bus and command health metrics in the Prometheus text format, so an
+unattended controller can alert when retries rise before commands fail.
+
+Nothing is measured until a METRICS is attached to a bus session: BUS
+and AIOBUS only check bus.metrics once per command, and frames are
+counted by a listener that exists only while metrics are on.
+
+Metrics (labelled with the serial port):
+  erv_commands_total{result}         Commands sent, result ok or failed
+  erv_command_attempts               Histogram of attempts per confirmed command
+  erv_command_seconds                Histogram of seconds per command (first write to confirmation)
+  erv_frames_total{class}            Valid frames received by class (see classify.py)
+  erv_received_bytes_total           Bytes read from the serial port
+  erv_received_bytes_per_second      Average since the previous export
+  erv_checksum_errors_total          Frames rejected by Check Sum or Frame End
+  erv_discarded_bytes_total          Bytes skipped while looking for Frame Start
+  erv_reconnects_total               Serial port reopened after the adapter went away
+
+Command-line Usage:
+  python3 ervd.py /dev/ttyUSB0 vautow --metrics 9108              <-- http://127.0.0.1:9108/metrics
+  python3 ervd.py /dev/ttyUSB0 vautow --metrics-file /var/lib/node_exporter/erv.prom
+
+Module import usage in script:
+  from metrics import METRICS
+  metrics = METRICS()
+  with BUS('/dev/ttyUSB0') as bus:
+      metrics.watch(bus)
+      metrics.serve(9108)          <-- Background HTTP endpoint
+      VAUTOW(bus=bus).standby()
+      metrics.write('erv.prom')    <-- Or a file for the node_exporter textfile collector
+      print(metrics.exposition())
+'''
+
+import os
+from bisect import bisect_left
+from time import monotonic
+from classify import classify
+
+ATTEMPT_BUCKETS = (1, 2, 3, 4, 5, 6, 7, 8)
+SECONDS_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, values)) + '}'
+
+
+class COUNTER:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # Label values -> count
+
+    def inc(self, *values, amount=1):
+        self.values[values] = self.values.get(values, 0) + amount
+
+    def exposition(self, kind='counter'):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {kind}']
+        for values, count in sorted(list(self.values.items())):
+            lines.append(f'{self.name}{_labels(self.labels, values)} {count}')
+        return lines
+
+
+class HISTOGRAM:
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labels = labels
+        self.values = {}  # Label values -> [count per bucket (+Inf last), sum]
+
+    def observe(self, value, *values):
+        entry = self.values.get(values)
+        if entry is None:
+            entry = self.values[values] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for values, (counts, total) in sorted(list(self.values.items())):
+            names = self.labels + ('le',)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(names, values + (bound,))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, values)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labels, values)} {cumulative}')
+        return lines
+
+
+class METRICS:
+    def __init__(self):
+        self.commands = COUNTER('erv_commands_total', 'Commands sent on the bus by result', ('port', 'result'))
+        self.attempts = HISTOGRAM('erv_command_attempts', 'Attempts used per confirmed command',
+                                  ATTEMPT_BUCKETS, ('port',))
+        self.seconds = HISTOGRAM('erv_command_seconds', 'Seconds from the first command frame to the ERV confirmation or giving up',
+                                 SECONDS_BUCKETS, ('port',))
+        self.frames = COUNTER('erv_frames_total', 'Valid frames received by class', ('port', 'class'))
+        self.buses = []
+        self.previous = {}  # Port -> (monotonic(), bytes) at the previous export, for bytes per second
+        self.server = None
+
+    def watch(self, bus):
+        '''Start measuring a BUS or AIOBUS session.'''
+        port = bus.port
+        bus.listeners.append(lambda frame, now: self.frames.inc(port, classify(frame)))
+        bus.metrics = self
+        self.buses.append(bus)
+        self.previous[port] = (monotonic(), bus.parser.received)
+        return self
+
+    def command(self, port, used, seconds):
+        '''Called by the bus session after every command (used = attempts, 0 = FAILED).'''
+        self.commands.inc(port, 'ok' if used else 'failed')
+        if used:
+            self.attempts.observe(used, port)
+        self.seconds.observe(seconds, port)
+
+    def _bus_counters(self):
+        names = {'erv_received_bytes_total': ('counter', 'Bytes read from the serial port'),
+                 'erv_received_bytes_per_second': ('gauge', 'Bytes per second read since the previous export'),
+                 'erv_checksum_errors_total': ('counter', 'Frames rejected by Check Sum or Frame End'),
+                 'erv_discarded_bytes_total': ('counter', 'Bytes skipped while looking for Frame Start'),
+                 'erv_reconnects_total': ('counter', 'Serial port reopened after the adapter went away')}
+        samples = {name: [] for name in names}
+        now = monotonic()
+        for bus in self.buses:
+            parser, port = bus.parser, bus.port
+            then, received = self.previous[port]
+            self.previous[port] = (now, parser.received)
+            samples['erv_received_bytes_total'].append((port, parser.received))
+            samples['erv_received_bytes_per_second'].append((port, round((parser.received - received) / max(now - then, 1e-9), 1)))
+            samples['erv_checksum_errors_total'].append((port, parser.errors))
+            samples['erv_discarded_bytes_total'].append((port, parser.discarded))
+            samples['erv_reconnects_total'].append((port, bus.reconnects))
+        lines = []
+        for name, (kind, help) in names.items():
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{_labels(("port",), (port,))} {value}' for port, value in samples[name]]
+        return lines
+
+    def exposition(self):
+        '''All metrics as Prometheus text exposition.'''
+        lines = (self.commands.exposition() + self.attempts.exposition() + self.seconds.exposition() +
+                 self.frames.exposition() + self._bus_counters())
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        '''Replace path with the current metrics in one step (node_exporter textfile collector).'''
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as file:
+            file.write(self.exposition())
+        os.replace(temporary, path)
+
+    def serve(self, port=9108, host='127.0.0.1'):
+        '''Serve GET /metrics from a background thread. Returns the HTTP server.'''
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class HANDLER(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    return self.send_error(404)
+                body = metrics.exposition().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # No line per scrape
+
+        self.server = ThreadingHTTPServer((host, port), HANDLER)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
@@ -0,0 +1,50 @@
+'''
+This is a MicroPython script, running on an ESP32 device, with a small
+uasyncio client for the local Webdis (Redis over HTTP) server, so
+several requests can be in flight at once and a slow one can be timed
+out without stalling the ERV control. webdis.py blocks the whole device
+until each response arrives.
+
+Module import usage in script:
+  from aiowebdis import AIOWEBDIS
+  webdis = AIOWEBDIS('192.168.1.10')
+  await webdis.get('nws-temperature')                     <-- '71.2'
+  await webdis.timeseriesget('webdis-local-aqi-average')  <-- [1700000000000, '12.5']
+  await webdis.timeseries('webdis-erv-state', 1)
+  await asyncio.wait_for_ms(webdis.get('epa-aqi'), 5000)  <-- Give up after 5 seconds
+'''
+
+import uasyncio as asyncio
+import ujson as json
+
+class AIOWEBDIS:
+    def __init__(self, host, port=7379):
+        self.host = host
+        self.port = port
+
+    async def command(self, *args):
+        '''Run one Redis command through Webdis and return its JSON result.'''
+        path = '/' + '/'.join(str(arg) for arg in args)
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(f'GET {path} HTTP/1.0\r\nHost: {self.host}\r\n\r\n'.encode())
+            await writer.drain()
+            status = await reader.readline()
+            if b' 200 ' not in status:
+                raise OSError(f'Webdis {path} {status}')
+            while (await reader.readline()) not in (b'\r\n', b''):
+                pass  # Skip the headers
+            body = await reader.read(-1)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+        return json.loads(body)[args[0]]
+
+    async def get(self, key):
+        return await self.command('GET', key)
+
+    async def timeseriesget(self, key):
+        return await self.command('TS.GET', key)
+
+    async def timeseries(self, key, value):
+        return await self.command('TS.ADD', key, '*', value)
@@ -1,6 +1,8 @@
 '''
 mpremote a0 mip install --target= github:bgant/erv/micropython/vttouchw.py
 mpremote a0 mip install --target= github:bgant/erv/micropython/main.py
+mpremote a0 mip install --target= github:bgant/erv/micropython/aiowebdis.py
+mpremote a0 mip install --target= github:bgant/erv/micropython/uploader.py
 mpremote a0 mip install --target= github:bgant/micropython/modules/wifi.py
 mpremote a0 mip install --target= github:bgant/micropython/modules/key_store.py
 mpremote a0 mip install --target= github:bgant/micropython/modules/timezone.py
@@ -10,7 +12,7 @@ mpremote a0 mip install --target= github:bgant/micropython/modules/webdis.py
 '''
 
 # Initialize Watchdog Timer
-from machine import reset, WDT, Timer
+from machine import reset, WDT
 wdt = WDT(timeout=600000)  # 10  Minute Hardware Watchdog Timer
 
 # Connect to Wifi and set Clock
@@ -20,8 +22,9 @@ wifi.connect()
 
 # Import Project Specific Modules
 from vttouchw import VTTOUCHW
-from utime import time, localtime, sleep
+from utime import time, localtime
 from timezone import tz
+import uasyncio as asyncio
 
 # If hitting remote API's directly
 #from OpenWeatherMap import WEATHER
@@ -29,20 +32,58 @@ from timezone import tz
 
 # If using locally cached Redis/Webdis data
 from webdis import WEBDIS
+from aiowebdis import AIOWEBDIS
+from uploader import UPLOADER
+webdis_config = WEBDIS()  # Local Redis/Webdis server, as configured for webdis.py
+webdis_host = webdis_config.webdis_host
+webdis_port = getattr(webdis_config, 'webdis_port', 7379)
 
-main_interval = 300000   # Minutes between Timer loops
+main_interval = 300000   # Milliseconds between control loops
+watch_interval = 10000   # Milliseconds between checks for a threshold crossing (smoke)
+
+class CACHE:
+    '''
+    One input value, fetched with a timeout and reused until it is ttl seconds old.
+    None if it could not be fetched (the checks print an error and ignore it).
+    '''
+    def __init__(self, fetch, ttl, timeout_ms=5000):
+        self.fetch = fetch          # Coroutine function returning the value
+        self.ttl = ttl
+        self.timeout_ms = timeout_ms
+        self.value = None
+        self.time = None            # time() of the last successful fetch
+        self.error = None           # Why the last fetch failed
+
+    async def get(self):
+        if self.time is not None and time() - self.time < self.ttl:
+            return self.value       # Still fresh, no request
+        try:
+            self.value = await asyncio.wait_for_ms(self.fetch(), self.timeout_ms)
+            self.time = time()
+        except Exception as e:      # Timeout, network or Webdis error
+            self.error = e
+            return None
+        return self.value
 
 class PROJECT:
-    '''Main project script run by Timer'''
+    '''Main project script run by the asyncio loop'''
     def __init__(self):
         self.erv = VTTOUCHW()
         #self.weather = WEATHER()
         #self.aqi = AQI()
         #self.PM_EPA = self.aqi.download('PM')  # Download on boot
-        self.temp = WEBDIS()
-        self.epa_aqi = WEBDIS()
-        self.local_aqi = WEBDIS()
-        self.upload_data = WEBDIS()
+        self.webdis = AIOWEBDIS(webdis_host, webdis_port)
+        # Every input is read again by each watch() check, so a threshold crossing is seen within watch_interval
+        self.temp = CACHE(lambda: self.webdis.get('nws-temperature'), ttl=watch_interval // 1000)
+        self.epa_aqi = CACHE(lambda: self.webdis.get('epa-aqi'), ttl=watch_interval // 1000)
+        self.local_aqi = CACHE(lambda: self.webdis.timeseriesget('webdis-local-aqi-average'), ttl=watch_interval // 1000)
+        # Time series uploaded in batches (spooled to flash while Webdis is unreachable)
+        self.uploader = UPLOADER(self.webdis, ('webdis-erv-state', 'webdis-erv-attempts'))
+        self.lock = asyncio.Lock()  # One control() at a time (timer loop and threshold watcher)
+        self.verbose = True
+        self.mode = None            # Mode the checks last chose
+        self.changed = 0            # time() the chosen mode last changed
+        self.attempts = None        # Bus attempts of the last command sent by control()
 
         # Thresholds
         self.spring         = 106  # Beginning of Summer Hours (Apr 15)
@@ -54,133 +95,201 @@ class PROJECT:
         self.high_epa_aqi   = 100  # ERV off above 100 PM2.5
         self.high_local_aqi =  40  # ERV off above  40 PM2.5
 
+        # Hysteresis: once a check fails, it only passes again this far back inside the threshold
+        self.temp_band      =   2  # i.e. back on above 34F after too cold
+        self.epa_aqi_band   =  10  # back on below  90 PM2.5
+        self.local_aqi_band =  10  # back on below  30 PM2.5
+        self.min_dwell      = 900  # Seconds in Standby before going back to Smart
+        self.too_hot_or_cold = self.epa_aqi_high = self.local_aqi_high = False  # Last check results
+
+    def say(self, message, end='\n'):
+        '''Print check results, except for the quiet checks of the threshold watcher'''
+        if self.verbose:
+            print(message, end=end)
+
     def night(self):
         '''Is it night right now?'''
         self.night_hours = [h % 24 for h in range(self.night_start,self.night_end+24)]
         #if self.spring < localtime(tz())[7] < self.fall:
-        #    print('OK:  Run 24x7 in Summer')
+        #    self.say('OK:  Run 24x7 in Summer')
         #    return False
         if localtime(tz())[3] in self.night_hours:
-            print('OFF: Nighttime')
+            self.say('OFF: Nighttime')
             return True
         else:
-            print('OK:  Daytime')
+            self.say('OK:  Daytime')
             return False
 
-    def outside_too_hot_or_cold(self):
+    def outside_too_hot_or_cold(self, response):
         '''Is it too hot or cold outside right now?'''
         # Using OpenWeatherMap API:
         #self.outside_temp = self.weather.download('temp')
 
-        # Using local Webdis/Redis:
+        # Using local Webdis/Redis (fetched by control):
         try:
-            self.temp.get('nws-temperature')  # Get temperature from local Redis/Webdis server
-            self.outside_temp = float(self.temp.response_text)
+            self.outside_temp = float(response)
         except:
-            print('ERROR: Failed to access National Weather Service data')
+            self.say('ERROR: Failed to access National Weather Service data')
             return False 
 
         if self.outside_temp:
-            if (self.outside_temp < self.too_cold) or (self.outside_temp > self.too_hot):
-                print(f'OFF: Too hot or cold at {self.outside_temp:.0f} F')
+            band = self.temp_band if self.too_hot_or_cold else 0
+            self.too_hot_or_cold = (self.outside_temp < self.too_cold + band) or (self.outside_temp > self.too_hot - band)
+            if self.too_hot_or_cold:
+                self.say(f'OFF: Too hot or cold at {self.outside_temp:.0f} F')
                 return True
             else:
-                print(f'OK:  Outside temperature is good at {self.outside_temp:.0f}F')
+                self.say(f'OK:  Outside temperature is good at {self.outside_temp:.0f}F')
                 return False
         else:
-            print(f'ERROR: API Response is {self.outside_temp}')
+            self.say(f'ERROR: API Response is {self.outside_temp}')
             return False
 
-    def epa_aqi_bad(self):
+    def epa_aqi_bad(self, response):
         '''Is the EPA Air Quality Index too high right now?'''
         # Using AirNowAPI (data updates about 10 to 30 minutes after each hour):
         #if 20 < localtime(tz())[4] < 30:
         #    self.PM_EPA = self.aqi.download('PM')
 
-        # Using local Webdis/Redis:
+        # Using local Webdis/Redis (fetched by control):
         try:
-            self.epa_aqi.get('epa-aqi')
-            self.PM_EPA = int(self.epa_aqi.response_text)
+            self.PM_EPA = int(response)
         except:
-            print('ERROR: Failed to access EPA AQI data')
+            self.say('ERROR: Failed to access EPA AQI data')
             return False
 
         if not self.PM_EPA:
-            print(f'ON:  EPA Air Quality Unknown (no data from API)') 
+            self.say(f'ON:  EPA Air Quality Unknown (no data from API)') 
             return False
-        elif self.PM_EPA > self.high_epa_aqi:
-            print(f'OFF: EPA Air Quality is too high at {self.PM_EPA}')
+        self.epa_aqi_high = self.PM_EPA > self.high_epa_aqi - (self.epa_aqi_band if self.epa_aqi_high else 0)
+        if self.epa_aqi_high:
+            self.say(f'OFF: EPA Air Quality is too high at {self.PM_EPA}')
             return True
         else:
-            print(f'OK:  EPA Air Quality is good at {self.PM_EPA}')
+            self.say(f'OK:  EPA Air Quality is good at {self.PM_EPA}')
             return False
 
-    def local_aqi_bad(self):
+    def local_aqi_bad(self, response):
         '''Is the outside Air Quality device to high right now? (neighbors burning leaves?)'''
-        # Using local Webdis/Redis:
+        # Using local Webdis/Redis (fetched by control):
         try:
-            self.local_aqi.timeseriesget('webdis-local-aqi-average')
-            self.aqi_timestamp = int(self.local_aqi.response_text[0]/1000) - 946684800  #13-digit Unix to 9-digit Micropython
-            self.aqi_local_number = float(self.local_aqi.response_text[1])
+            self.aqi_timestamp = int(response[0]/1000) - 946684800  #13-digit Unix to 9-digit Micropython
+            self.aqi_local_number = float(response[1])
         except:
-            print('ERROR: Failed to access Local AQI data')
+            self.say('ERROR: Failed to access Local AQI data')
             return False
 
         if (time() - self.aqi_timestamp) < 300:  # AQI is recent? less than 5 min
-            if self.aqi_local_number >= self.high_local_aqi:
-                print(f'OFF: Local Air Quality is too high at {self.aqi_local_number:.0f}')
+            self.local_aqi_high = self.aqi_local_number >= self.high_local_aqi - (self.local_aqi_band if self.local_aqi_high else 0)
+            if self.local_aqi_high:
+                self.say(f'OFF: Local Air Quality is too high at {self.aqi_local_number:.0f}')
                 return True
             else:
-                print(f'OK:  Local Air Quality is good at {self.aqi_local_number:.0f}')
+                self.say(f'OK:  Local Air Quality is good at {self.aqi_local_number:.0f}')
                 return False
         else:
-            print('OK:  Ignoring... No recent Local AQI data')
+            self.say('OK:  Ignoring... No recent Local AQI data')
             return False
     
-    def control(self):
-        '''Check everything and decide whether to turn ERV On or Off'''
+    async def fetch(self):
+        '''All inputs at the same time, each with its own timeout and cache'''
+        return await asyncio.gather(self.local_aqi.get(), self.epa_aqi.get(), self.temp.get())
+
+    def decide(self, local_aqi, epa_aqi, temp):
+        '''Mode the checks call for right now'''
         if self.night():
-            self.standby()
-        elif not self.local_aqi_bad() and not self.epa_aqi_bad() and not self.outside_too_hot_or_cold():
-            print('OK:  All Checks Passed')
-            self.smart()
+            return 'standby'
+        elif not self.local_aqi_bad(local_aqi) and not self.epa_aqi_bad(epa_aqi) and not self.outside_too_hot_or_cold(temp):
+            self.say('OK:  All Checks Passed')
+            return 'smart'
         else:
-            print('OFF: One or More Checks Failed')
-            self.standby()
-        print()
-        self.upload_erv_state()
+            self.say('OFF: One or More Checks Failed')
+            return 'standby'
+
+    def dwelling(self, mode):
+        '''Too soon to leave Standby for Smart?'''
+        return mode == 'smart' and self.mode == 'standby' and time() - self.changed < self.min_dwell
 
-    def smart(self):
+    async def control(self):
+        '''Check everything and decide whether to turn ERV On or Off'''
+        async with self.lock:
+            mode = self.decide(*await self.fetch())
+            if self.dwelling(mode):
+                print(f'WAIT: Staying in Standby for at least {self.min_dwell // 60} minutes')
+                mode = 'standby'
+            if mode != self.mode:
+                self.mode = mode
+                self.changed = time()
+            await self.set_mode(mode)
+            print()
+            self.upload_erv_state()  # Only queued, the uploader task talks to Webdis
+
+    async def watch(self):
+        '''
+        Check the inputs every watch_interval (all three are fetched that
+        often, control() reuses them if they are fresh) and run control()
+        as soon as a threshold is crossed, instead of waiting up to main_interval.
+        '''
+        while True:
+            await asyncio.sleep_ms(watch_interval)
+            try:
+                values = await self.fetch()
+                self.verbose = False
+                try:
+                    mode = self.decide(*values)
+                finally:
+                    self.verbose = True
+                if self.mode is not None and mode != self.mode and not self.dwelling(mode):
+                    print(f'CHANGE: Checks now call for {mode}')
+                    await self.control()
+            except Exception as e:
+                print(f'ERROR: {e!r}')
+
+    async def set_mode(self, mode):
+        self.attempts = None  # Bus attempts, if a command is sent
+        if mode == 'smart':
+            await self.smart()
+        else:
+            await self.standby()
+
+    async def smart(self):
         '''Change ERV mode to Smart'''
-        if (self.erv.state == 'smart') and ('OK' in self.erv.status):
+        mode = await self.erv.amode()  # Reported by the ERV itself, so correct after a reboot or wall control button press
+        if (mode == 'smart') or (mode is None and self.erv.state == 'smart' and 'OK' in self.erv.status):
             print('ERV already in Smart mode')
         else:
             print('Setting ERV to Smart mode ', end='')
-            self.erv.smart()    # Turn ON ERV
+            await self.erv.asend_frames('smart')  # Turn ON ERV
+            self.attempts = self.erv.status.count('.')
 
-    def standby(self):
+    async def standby(self):
         '''Change ERV mode to Standby'''
-        if (self.erv.state == 'standby') and ('OK' in self.erv.status):
+        mode = await self.erv.amode()
+        if (mode == 'standby') or (mode is None and self.erv.state == 'standby' and 'OK' in self.erv.status):
             print('ERV already in Standby mode.')
         else:
             print('Setting ERV to Standby mode ', end='')
-            self.erv.standby()  # Turn OFF ERV
+            await self.erv.asend_frames('standby')  # Turn OFF ERV
+            self.attempts = self.erv.status.count('.')
 
     def upload_erv_state(self):
-        if self.erv.state == 'standby':
-            self.upload_data.timeseries('webdis-erv-state',0)
-        if self.erv.state == 'smart':
-            self.upload_data.timeseries('webdis-erv-state',1)
-        
+        states = {'standby': 0, 'smart': 1}
+        if self.erv.state in states:
+            self.uploader.add('webdis-erv-state', states[self.erv.state])
+        if self.attempts is not None:
+            self.uploader.add('webdis-erv-attempts', self.attempts)
 
 project = PROJECT()
-timer_main = Timer(0)
-
-def timer_function(timer_main):
-    project.control()
-    wdt.feed()
 
-timer_function(timer_main)  # Initial Run on Boot
-timer_main.init(period=main_interval, callback=timer_function)
-# View Timer value: timer_main.value()   Stop Timer: timer_main.deinit()
+async def main():
+    asyncio.create_task(project.watch())  # React to smoke within seconds
+    asyncio.create_task(project.uploader.run())
+    while True:
+        try:
+            await project.control()
+        except Exception as e:
+            print(f'ERROR: {e!r}')
+        wdt.feed()
+        await asyncio.sleep_ms(main_interval)
 
+asyncio.run(main())  # Initial run on boot, then every main_interval
@@ -0,0 +1,202 @@
+'''
+This is a MicroPython script, running on an ESP32 device, that batches
+time series points for the local Webdis/Redis server.
+
+Points go into preallocated arrays (key number, time, value) and are
+sent together in one TS.MADD request every flush_points points or
+flush_ms milliseconds. If Webdis cannot be reached, the points are
+moved to a fixed-size ring file in flash (oldest points are overwritten
+when it is full) and sent after the next successful upload, so nothing
+grows in RAM while the Wi-Fi is down.
+
+Spool file encoding:
+  NNNN CCCC     Next record slot, records in use (little-endian uint32)
+  K TTTT VVVV   One record per point: key number, time() seconds, float32 value
+
+Module import usage in script:
+  from uploader import UPLOADER
+  uploader = UPLOADER(webdis, ('webdis-erv-state', 'webdis-erv-attempts'))
+  asyncio.create_task(uploader.run())
+  uploader.add('webdis-erv-state', 1)   <-- No network, returns at once
+'''
+
+import uasyncio as asyncio
+import os
+import struct
+from array import array
+from utime import time, ticks_ms, ticks_diff
+
+EPOCH_OFFSET = 946684800  # MicroPython time() counts from 2000, Redis from 1970
+RECORD_FORMAT = '<BIf'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+class SPOOL:
+    '''Fixed-size ring of points in a flash file.'''
+    def __init__(self, path='spool.bin', records=2048):
+        self.path = path
+        self.records = records
+        self.record = bytearray(RECORD_SIZE)
+        self.header = bytearray(8)
+        self.file = None
+        size = 8 + records * RECORD_SIZE
+        try:
+            if os.stat(path)[6] != size:  # Torn or from a different records setting
+                raise ValueError('spool size changed')
+            self.file = open(path, 'r+b')
+            self.file.readinto(self.header)
+            self.next, self.count = struct.unpack('<II', self.header)
+            if self.next >= records or self.count > records:
+                raise ValueError('spool header out of range')
+        except (OSError, ValueError):
+            if self.file:
+                self.file.close()
+            self.file = open(path, 'w+b')
+            zeros = bytearray(64)
+            for i in range(0, size, 64):
+                self.file.write(memoryview(zeros)[:min(64, size - i)])
+            self.next = self.count = 0
+            self._save()
+
+    def _save(self):
+        struct.pack_into('<II', self.header, 0, self.next, self.count)
+        self.file.seek(0)
+        self.file.write(self.header)
+        self.file.flush()
+
+    def write(self, keys, times, values, count, start=0):
+        '''Append points start to count, overwriting the oldest when the ring is full.'''
+        for i in range(start, count):
+            self._append(keys[i], times[i], values[i])
+        self._save()  # Header written once per batch to spare the flash
+
+    def add(self, key, moment, value):
+        '''Append one point.'''
+        self._append(key, moment, value)
+        self._save()
+
+    def _append(self, key, moment, value):
+        struct.pack_into(RECORD_FORMAT, self.record, 0, key, moment, value)
+        self.file.seek(8 + self.next * RECORD_SIZE)
+        self.file.write(self.record)
+        self.next = (self.next + 1) % self.records
+        if self.count < self.records:
+            self.count += 1
+
+    def read(self, keys, times, values, limit):
+        '''Copy up to limit of the oldest points into the arrays. Returns how many.'''
+        count = min(limit, self.count)
+        oldest = (self.next - self.count) % self.records
+        for i in range(count):
+            self.file.seek(8 + ((oldest + i) % self.records) * RECORD_SIZE)
+            self.file.readinto(self.record)
+            keys[i], times[i], values[i] = struct.unpack(RECORD_FORMAT, self.record)
+        return count
+
+    def drop(self, count):
+        '''Forget the count oldest points (after they were uploaded).'''
+        self.count -= min(count, self.count)
+        self._save()
+
+
+class UPLOADER:
+    def __init__(self, webdis, keys, capacity=32, flush_points=16, flush_ms=60000, timeout_ms=10000, spool=None):
+        self.webdis = webdis
+        self.keys = keys                 # Series names, only ever add new ones at the end (the spool stores the index)
+        self.capacity = capacity
+        self.flush_points = flush_points
+        self.flush_ms = flush_ms
+        self.timeout_ms = timeout_ms
+        self.spool = spool or SPOOL()
+        self.key = bytearray(capacity)   # Preallocated point buffer
+        self.time = array('I', bytes(4 * capacity))
+        self.value = array('f', bytes(4 * capacity))
+        self.send_key = bytearray(capacity)  # Points in the TS.MADD being sent (buffer snapshot or spool replay)
+        self.send_time = array('I', bytes(4 * capacity))
+        self.send_value = array('f', bytes(4 * capacity))
+        self.count = 0
+        self.sending = 0                 # Oldest points in the buffer that are in the upload in flight
+        self.first = ticks_ms()          # ticks_ms() of the oldest point in the buffer
+        self.uploaded = 0
+        self.spooled = 0
+        self.failures = 0
+
+    def add(self, key, value, moment=None):
+        '''Queue one point. Spools the buffer to flash if it is full (Webdis unreachable).'''
+        moment = time() if moment is None else moment
+        if self.count == self.capacity:
+            if self.sending == self.count:  # The whole buffer is the upload in flight
+                self.spool.add(self.keys.index(key), moment, value)
+                self.spooled += 1
+                return
+            self._spool()
+        if not self.count:
+            self.first = ticks_ms()
+        i = self.count
+        self.key[i] = self.keys.index(key)
+        self.time[i] = moment
+        self.value[i] = value
+        self.count = i + 1
+
+    def _spool(self):
+        self.spool.write(self.key, self.time, self.value, self.count, self.sending)
+        self.spooled += self.count - self.sending
+        self.count = self.sending       # The points in flight stay until the upload finishes
+
+    def _remove(self, count):
+        '''Drop the count oldest points, keeping the ones added since.'''
+        count = min(count, self.count)
+        for i in range(count, self.count):
+            self.key[i - count] = self.key[i]
+            self.time[i - count] = self.time[i]
+            self.value[i - count] = self.value[i]
+        self.count -= count
+
+    async def _send(self, count):
+        '''The first count send points in one TS.MADD request.'''
+        args = []
+        for i in range(count):
+            args.append(self.keys[self.send_key[i]])
+            args.append((self.send_time[i] + EPOCH_OFFSET) * 1000)
+            args.append(self.send_value[i])
+        await asyncio.wait_for_ms(self.webdis.command('TS.MADD', *args), self.timeout_ms)
+        self.uploaded += count
+
+    async def flush(self):
+        '''Upload the buffer, then anything spooled while offline.'''
+        count = self.sending = self.count  # add() may run while the request is out
+        if count:
+            for i in range(count):
+                self.send_key[i] = self.key[i]
+                self.send_time[i] = self.time[i]
+                self.send_value[i] = self.value[i]
+            try:
+                await self._send(count)
+            except Exception as e:
+                print(f'ERROR: Upload failed, spooling {self.count} points ({e!r})')
+                self.failures += 1
+                self.sending = 0
+                self._spool()
+                return False
+            self._remove(count)
+            self.sending = 0
+            if self.count:
+                self.first = ticks_ms()
+        while self.spool.count:  # Back online, replay the spool one buffer at a time
+            count = self.spool.read(self.send_key, self.send_time, self.send_value, self.capacity)
+            try:
+                await self._send(count)
+            except Exception as e:
+                print(f'ERROR: Spool replay failed, {self.spool.count} points waiting ({e!r})')
+                self.failures += 1
+                return False
+            self.spool.drop(count)
+        return True
+
+    async def run(self):
+        '''Flush every flush_points points or flush_ms milliseconds.'''
+        while True:
+            await asyncio.sleep_ms(1000)
+            if self.count >= self.flush_points or \
+               (self.count or self.spool.count) and ticks_diff(ticks_ms(), self.first) >= self.flush_ms:
+                if not await self.flush():
+                    self.first = ticks_ms()  # Try again in flush_ms
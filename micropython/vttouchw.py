@@ -9,115 +9,261 @@ Module import usage in script:
   erv.commands()
   erv.smart()
   erv.standby()
+  erv.mode()   <-- Mode the ERV reports on the bus (None if not heard)
   erv.state
   erv.status
   help(erv)
+
+Module import usage in a uasyncio task (other tasks run while it waits on the bus):
+  await erv.amode()
+  await erv.asend_frames('smart')
 '''
 
 from machine import UART
-from time import sleep_ms
+from time import sleep_ms, ticks_ms, ticks_diff
+import uasyncio as asyncio
+
+FRAMES = {  # Generated by: python3 frames.py micropython
+    'standby': b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x01\x08\x20\x01\x00\x49\x04',
+    'smart': b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x11\x08\x20\x01\x00\x39\x04',
+    'away': b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x0f\x08\x20\x01\x00\x3b\x04',
+    'min': b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x09\x08\x20\x01\x00\x41\x04',
+    'med': b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x0b\x08\x20\x01\x00\x3f\x04',
+    'max': b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x0a\x08\x20\x01\x00\x40\x04',
+    'recircmin': b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x05\x08\x20\x01\x00\x45\x04',
+    'recircmed': b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x07\x08\x20\x01\x00\x43\x04',
+    'recircmax': b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x06\x08\x20\x01\x00\x44\x04',
+    }
+RX1 = b'\x01\x12\x10\x01\x05\x41\x08\x20\x00\x20\x4f\x04'  # Same ERV response for all control commands
+
+NAMES = {frame[9]: command for command, frame in FRAMES.items()}  # Mode byte -> command
+MODE_REGISTERS = (0x2001, 0x2002)  # ERV reports its current mode in these x21 read response registers
+
+def _prefixes(pattern):
+    '''Length of the longest proper prefix of pattern that ends at each byte (KMP table).'''
+    table = bytearray(len(pattern))
+    k = 0
+    for i in range(1, len(pattern)):
+        while k and pattern[i] != pattern[k]:
+            k = table[k - 1]
+        if pattern[i] == pattern[k]:
+            k += 1
+        table[i] = k
+    return bytes(table)
+
+RX1_PREFIXES = _prefixes(RX1)  # Lets the RX1 match resume mid-frame as bytes arrive
 
 class VTTOUCHW:
     def __init__(self):
         self.attempts = 11
+        self.timeout_ms = 100  # Wait for RX1 after each attempt (one bus exchange is ~10 ms)
+        self.retry_ms = 20     # Pause before the next attempt, about one ~18 ms poll cycle
+        self.poll_ms = 2       # amode()/asend_frames() sleep between UART reads (~8 bytes at 38400 baud)
         self.command_list = ('standby','smart','away','min','med','max','recircmin','recircmed','recircmax')
-        self.Rx1 = b'\x01\x12\x10\x01\x05\x41\x08\x20\x00\x20\x4f\x04'  # Same ERV response for all control commands
         self.buffer = bytearray(400)
+        self.view = memoryview(self.buffer)  # Made once, mode() reads into slices of it
+        self.ignore_first_ok = True  # Three times .OK was seen and the ERV mode did not change, so try again
         self.status = None
         self.state = None
+        self.code = None       # Last mode byte the ERV reported on the bus
+        self.code_time = None  # ticks_ms() of that report
 
         # UART Configuration 
         self.rx = 8
         self.tx = 9
         self.uart = UART(1, 38400)
-        self.uart.init(38400, bits=8, parity=None, stop=1, rx=self.rx, tx=self.tx)
+        self.uart.init(38400, bits=8, parity=None, stop=1, rx=self.rx, tx=self.tx, timeout=0)
 
     def reset(self):
         '''Re-initialize RS485 Communication'''
         self.uart = UART(1, 38400)
-        self.uart.init(38400, bits=8, parity=None, stop=1, rx=self.rx, tx=self.tx) 
+        self.uart.init(38400, bits=8, parity=None, stop=1, rx=self.rx, tx=self.tx, timeout=0)
 
     def commands(self):
         '''Print list of valid ERV/HRV control commands.'''
         self._command_string = ' | '.join(map(str,self.command_list))
         return print(f'Controls: {self._command_string}')
 
-    def send_frames(self):
+    def _scan(self, count):
+        '''
+        Look for ERV mode reports in the first count bytes of the buffer.
+        Returns the index of the first byte that is not a complete frame yet.
+        '''
+        b = self.buffer
+        i = 0
+        while i + 7 <= count:
+            if b[i] != 0x01 or b[i+3] != 0x01:  # Frame Start / always 01
+                i += 1
+                continue
+            end = i + b[i+4] + 7
+            if end > count:
+                return i  # Rest of the frame has not arrived yet
+            if b[end-1] != 0x04:
+                i += 1
+                continue
+            if b[i+4] >= 5 and b[i+5] == 0x21:  # Read response: register, length, data...
+                p = i + 6
+                while p + 3 <= end - 2:
+                    register = b[p] | b[p+1] << 8
+                    size = b[p+2]
+                    p += 3
+                    if p + size > end - 2:
+                        break
+                    if register in MODE_REGISTERS and size == 1:
+                        self.code = b[p]
+                        self.code_time = ticks_ms()
+                    p += size
+            i = end
+        return i
+
+    def _listen(self, fill):
+        '''Read into the buffer after fill bytes and scan for mode reports. Returns the new fill.'''
+        n = self.uart.readinto(self.view[fill:])
+        if n:
+            fill += n
+            used = self._scan(fill)
+            fill -= used
+            self.buffer[:fill] = self.buffer[used:used + fill]  # Keep the partial frame
+        return fill
+
+    def _stale(self, max_age_ms):
+        return self.code_time is None or ticks_diff(ticks_ms(), self.code_time) > max_age_ms
+
+    def mode(self, max_age_ms=10000, listen_ms=3500):
+        '''Mode the ERV reports on the bus, listening up to listen_ms for its ~3 second telemetry exchange.'''
+        fill = 0
+        start = ticks_ms()
+        while self._stale(max_age_ms):
+            if ticks_diff(ticks_ms(), start) > listen_ms:
+                return None
+            fill = self._listen(fill)
+        return NAMES.get(self.code, self.code)
+
+    async def amode(self, max_age_ms=10000, listen_ms=3500):
+        '''mode() that sleeps between UART reads instead of holding the uasyncio loop.'''
+        fill = 0
+        start = ticks_ms()
+        while self._stale(max_age_ms):
+            if ticks_diff(ticks_ms(), start) > listen_ms:
+                return None
+            fill = self._listen(fill)
+            await asyncio.sleep_ms(self.poll_ms)
+        return NAMES.get(self.code, self.code)
+
+    def _match(self, count, matched):
+        '''
+        Continue matching RX1 over the first count bytes of the buffer,
+        matched bytes of it already seen. Returns the new matched count
+        (len(RX1) as soon as the whole frame is seen).
+        '''
+        b = self.buffer
+        for i in range(count):
+            byte = b[i]
+            while matched and byte != RX1[matched]:
+                matched = RX1_PREFIXES[matched - 1]
+            if byte == RX1[matched]:
+                matched += 1
+                if matched == len(RX1):
+                    return matched
+        return matched
+
+    def _attempt(self, tx1):
+        '''Start one attempt: drop older bus traffic and write the command frame.'''
+        self.status += '.'  # Each dot represents one attempt in the while loop
+        print('.', end='')
+        while self.uart.any():  # Drop bus traffic from before this attempt
+            self._scan(self.uart.readinto(self.buffer) or 0)  # Also picks up the ERV mode report
+        self.sent = self.uart.write(tx1)
+
+    def _receive(self, matched):
+        '''Match what has arrived since the last call against RX1. Returns the new matched count.'''
+        n = self.uart.readinto(self.buffer)
+        if n:
+            self._scan(n)
+            matched = self._match(n, matched)
+        return matched
+
+    def _result(self, ok):
+        # The x41 confirmation does not carry the mode, so the last mode report is stale
+        if ok:
+            self.code = FRAMES[self.state][9]
+            self.code_time = ticks_ms()
+        else:
+            self.code_time = None  # Unknown until the ERV reports it again
+        self.status += 'OK' if ok else 'FAILED'
+        print('OK' if ok else 'FAILED')
+
+    def send_frames(self, command):
         '''Send command frames to the ERV/HRV over the RS485 wires.'''
+        self.state = command
+        tx1 = FRAMES[command]
         # May need a few attempts to change the control state...
-        # pySerial RS485 support WARNING: This may work unreliably on some serial
-        # ports (control signals not synchronized or delayed compared to data). Using
-        # delays may be unreliable (varying times, larger than expected) as the OS
-        # may not support very fine grained delays.
+        # Only bytes received after each write are matched against RX1, so a
+        # confirmation left over from an earlier command cannot look like an
+        # OK. The first OK is still ignored (ignore_first_ok) until that is
+        # shown to be why .OK sometimes left the mode unchanged.
         self.status = ''
         for i in range(self.attempts):
-            self.status += '.'  # Each dot represents one attempt in the while loop
-            print('.', end='')
-            self.sent = self.uart.write(self.Tx1)
-            self.uart.readinto(self.buffer)
-            if self.Rx1 in self.buffer:
-                if i == 0: # Three times I have seen .OK and the ERV mode did not change
-                    pass   # Ignore first attemp even if it is successful
-                else:
-                    self.status += 'OK'
-                    print('OK')
-                    break
-            self.buffer[:] = b'\x00' * len(self.buffer)  # Clear buffer
-            sleep_ms(250)
-        else:
-            self.status += 'FAILED'
-            print('FAILED')
+            self._attempt(tx1)
+            matched = 0
+            start = ticks_ms()
+            while matched < len(RX1) and ticks_diff(ticks_ms(), start) < self.timeout_ms:
+                matched = self._receive(matched)
+            if matched == len(RX1) and (i or not self.ignore_first_ok):
+                return self._result(True)
+            sleep_ms(self.retry_ms)
+        self._result(False)
+
+    async def asend_frames(self, command):
+        '''send_frames() that sleeps while waiting for RX1 instead of holding the uasyncio loop.'''
+        self.state = command
+        tx1 = FRAMES[command]
+        self.status = ''
+        for i in range(self.attempts):
+            self._attempt(tx1)
+            matched = 0
+            start = ticks_ms()
+            while matched < len(RX1) and ticks_diff(ticks_ms(), start) < self.timeout_ms:
+                matched = self._receive(matched)
+                if matched < len(RX1):
+                    await asyncio.sleep_ms(self.poll_ms)
+            if matched == len(RX1) and (i or not self.ignore_first_ok):
+                return self._result(True)
+            await asyncio.sleep_ms(self.retry_ms)
+        self._result(False)
 
     def standby(self):
         '''Standby (STB) - Stops ERV ventilation motor and closes internal dampers to outside ducts.'''
-        self.state = 'standby'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x01\x08\x20\x01\x00\x49\x04'
-        self.send_frames()
+        self.send_frames('standby')
 
     def smart(self):
         '''Smart (SMT) - Operates automatically based on outdoor temperature and indoor humidity.'''
-        self.state = 'smart'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x11\x08\x20\x01\x00\x39\x04'
-        self.send_frames()
+        self.send_frames('smart')
 
     def min(self):
         '''Continuous Minimum - Continuous exchange ventilation at selected speed.'''
-        self.state = 'min'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x09\x08\x20\x01\x00\x41\x04'
-        self.send_frames() 
+        self.send_frames('min')
 
     def med(self):
         '''Continuous Medium - Continuous exchange ventilation at selected speed.'''
-        self.state = 'med'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x0b\x08\x20\x01\x00\x3f\x04'
-        self.send_frames()
+        self.send_frames('med')
 
     def max(self):
         '''Continuous Maximum - Continuous exchange ventilation at selected speed.'''
-        self.state = 'max'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x0a\x08\x20\x01\x00\x40\x04'
-        self.send_frames()
+        self.send_frames('max')
 
     def recircmin(self):
         '''Recirculation Minimum - Closes dampers to outside ducts and recirculates air inside house at MIN speed.'''
-        self.state = 'recircmin'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x05\x08\x20\x01\x00\x45\x04'
-        self.send_frames()
+        self.send_frames('recircmin')
 
     def recircmed(self):
         '''Recirculation Medium - Closes dampers to outside ducts and recirculates air inside house at MED speed.'''
-        self.state = 'recircmed'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x07\x08\x20\x01\x00\x43\x04'
-        self.send_frames()
+        self.send_frames('recircmed')
 
     def recircmax(self):
         '''Recirculation Maximum - Closes dampers to outside ducts and recirculates air inside house at MAX speed.'''
-        self.state = 'recircmax'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x06\x08\x20\x01\x00\x44\x04'
-        self.send_frames()
+        self.send_frames('recircmax')
 
     def away(self):
         '''Away - 10 minutes outside ventilation / 50 minutes off every hour.'''
-        self.state = 'away'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x0f\x08\x20\x01\x00\x3b\x04'
-        self.send_frames() 
+        self.send_frames('away')
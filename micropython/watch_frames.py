@@ -1,46 +1,58 @@
 from machine import reset, UART
+from time import ticks_ms, ticks_diff
+from capture import CAPTURE
 uart = UART(1, 38400)
-uart.init(38400, bits=8, parity=None, stop=1, rx=8, tx=9)
+uart.init(38400, bits=8, parity=None, stop=1, rx=8, tx=9, timeout=0, rxbuf=1024)
 
-single_byte = bytearray(1)
-frame = bytearray()
+# Frame classes (same as classify.py), only CONTROL, CONFIRMATION and UNKNOWN are printed
+POLL, TELEMETRY, COUNTER, CONTROL, CONFIRMATION, UNKNOWN = range(6)
+SHOW = (CONTROL, CONFIRMATION, UNKNOWN)
 
-skip_repeats = [
-    '011012010104d804', '011210010105d704',
-    '011210010104d804', '011012010105d704',
-    '011012010104d804011210010105d704',
-    '01121001092102300101003001004e04',
-    '011210010d211450010013500101125001028004',
-    '0110120109200c210d2108500950a804',
-    '011210011521102201000f220100062101010521010104210101ca04',
-    '01121001142109500428000000085001010d2101010c2101016a04',
-    '011012010b200421052106210f221022dd04',
-    '011012010b20022203220a220c220e22df04',
-    '011012010b2008300930195020502150f704',
-    '011210011b2121500101205001011950010009300400a7760008300447ee6d001a04',
-    '011012010f2000200220062007200820033004309004',
-    '011210012321043004000000000330040000000008200100072001010620010902200111002001114204',
-    '011210011e210c2204000028420a2204000028420e22010003220100022204840300006204',
-    '0110120107201250135014508d04',
-    '01101201092012001a0001e00af0ad04',
-    '011012010520003002305604',
-    '011210010104d804011012010105d704',
-    '0110120104400050004904',
-    '01121001034100504904',
-    ]
+# (sender << 16 | receiver << 8 | opcode) -> class for the ERV (10) and VTTOUCHW (12)
+# Writes and acknowledgements of registers not in REGISTERS are UNKNOWN (an undecoded button)
+PREFIXES = {
+    0x101220: TELEMETRY, 0x121021: TELEMETRY,  # Register reads and responses
+    0x101240: UNKNOWN, 0x121041: UNKNOWN,      # Register writes and acknowledgements
+    }
 
+# (opcode << 16 | first register) -> class, for the command, counter and periodic write registers
+# (kept under 31 bits so the keys stay small ints and never allocate)
+REGISTERS = {}
+for register in (0x2000, 0x2003, 0x2008, 0x2200, 0x2202, 0x2203, 0x2206, 0x2208):
+    REGISTERS[0x40 << 16 | register] = CONTROL       # Tx1 mode write
+    REGISTERS[0x41 << 16 | register] = CONFIRMATION  # Rx1 acknowledgement
+REGISTERS[0x20 << 16 | 0x2001] = CONTROL             # Tx3 read back
+REGISTERS[0x21 << 16 | 0x2001] = CONFIRMATION        # Rx3 mode response
+for register in (0x5000, 0x5004, 0x5005, 0x5007):    # Periodic writes the ERV repeats on its own
+    REGISTERS[0x40 << 16 | register] = TELEMETRY
+    REGISTERS[0x41 << 16 | register] = TELEMETRY
+REGISTERS[0x20 << 16 | 0x0014] = COUNTER             # Timing/counter every 10 seconds
+REGISTERS[0x21 << 16 | 0x0014] = COUNTER
+
+def classify(frame, length):
+    '''Class of the frame in frame[:length] without copying or hex.'''
+    if frame[4] == 1:
+        return POLL
+    found = PREFIXES.get(frame[1] << 16 | frame[2] << 8 | frame[5])
+    if found is None:
+        return UNKNOWN
+    if length >= 10:
+        return REGISTERS.get(frame[5] << 16 | frame[6] | frame[7] << 8, found)
+    return found
+
+def show(frame, length):
+    if classify(frame, length) in SHOW:
+        print(frame[:length].hex())
+
+# Bytes go into a preallocated ring buffer and frames are found in place (see capture.py),
+# so nothing is allocated per byte or frame and the garbage collector stays quiet
+capture = CAPTURE(uart, handler=show)
+irq = capture.start_irq()  # Fall back to polling if the firmware has no UART.IRQ_RXIDLE
+reported = ticks_ms()
 while True:
-    single_byte = uart.read(1) # Read next RS485 byte
-    if single_byte:  # True if contains data / False if b''
-        frame.extend(single_byte)  # Read bytes into frame bytearray
-    elif frame:  # True if frame contains data / False if b''
-        if frame.hex() in skip_repeats or \
-        '011210019' in frame.hex() or \
-        '008bc504044eed' in frame.hex(): # Ignore repeating frames and timing frames
-            pass
-        else:
-            print(frame.hex())
-        frame = bytearray()  # Reset to b'' for next cycle
-    else:
-        # frame is b''
-        pass
+    if not irq:
+        capture.poll()
+    capture.process()
+    if ticks_diff(ticks_ms(), reported) > 60000:  # Bus health every minute
+        reported = ticks_ms()
+        print(capture.counters())
@@ -0,0 +1,130 @@
+'''
+RS485 serial port opened with termios and plain file descriptor I/O,
+as an alternative to pySerial's serial.rs485.RS485 for BUS and AIOBUS.
+
+pySerial switches the RS485 driver enable (RTS) from user space: it
+sleeps delay_before_tx, writes, waits for the frame to drain and then
+flips RTS back, and the OS may stretch each of those steps. Here the
+tty is asked to do it with the kernel TIOCSRS485 ioctl instead, so the
+UART driver (or the adapter) turns the driver on and off around each
+frame with its own timing. Writes are os.write() and reads are
+non-blocking os.readv() into one preallocated buffer.
+
+Pseudo-terminals (simulator.py) and adapters whose driver has no
+TIOCSRS485 (most USB-to-RS485 adapters switch direction by themselves)
+fall back to a plain raw tty, and kernel_rs485 is False.
+
+Select it for a session or with an environment variable:
+  BUS('/dev/ttyUSB0', backend='termios')
+  ERV_BACKEND=termios python3 vttouchw.py /dev/ttyUSB0 smart
+
+Compare command latency with pySerial on the simulator:
+  python3 benchmark.py           <-- 'backends' in the results
+
+Module import usage in script:
+  from rs485 import TERMIOS
+  port = TERMIOS('/dev/ttyUSB0', 38400, timeout=0.005, delay_before_tx=0.005)
+  port.kernel_rs485   <-- True if the driver handles the RS485 direction
+  port.write(frame)
+  data = port.read(port.in_waiting or 1)   <-- memoryview, valid until the next read
+  port.close()
+'''
+
+import errno
+import fcntl
+import os
+import select
+import struct
+import termios
+
+TIOCGRS485 = 0x542E
+TIOCSRS485 = 0x542F
+SER_RS485_ENABLED = 1 << 0
+SER_RS485_RTS_ON_SEND = 1 << 1
+SER_RS485_RTS_AFTER_SEND = 1 << 2
+RS485 = struct.Struct('8I')  # struct serial_rs485: flags, delay_rts_before_send (ms), delay_rts_after_send (ms), padding
+NOT_SUPPORTED = (errno.ENOTTY, errno.EINVAL, errno.EOPNOTSUPP, 515)  # 515 = ENOIOCTLCMD from some drivers
+
+class TERMIOS:
+    def __init__(self,port='/dev/ttyUSB0',baudrate=38400,timeout=0.005,delay_before_tx=0.005,
+                 rts_level_for_tx=False,rts_level_for_rx=True,size=4096):
+        self.port = port
+        self.timeout = timeout                # Seconds read() waits for the first byte
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            self._configure(baudrate)
+            self.kernel_rs485 = self._rs485(delay_before_tx, rts_level_for_tx, rts_level_for_rx)
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    def _configure(self, baudrate):
+        '''Raw 8N1 at baudrate, reads never block (select() does the waiting).'''
+        iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(self.fd)
+        iflag &= ~(termios.IGNBRK | termios.BRKINT | termios.PARMRK | termios.ISTRIP | termios.INLCR |
+                   termios.IGNCR | termios.ICRNL | termios.IXON | termios.IXOFF | termios.IXANY | termios.INPCK)
+        oflag &= ~termios.OPOST
+        lflag &= ~(termios.ECHO | termios.ECHONL | termios.ICANON | termios.ISIG | termios.IEXTEN)
+        cflag &= ~(termios.CSIZE | termios.PARENB | termios.CSTOPB | getattr(termios, 'CRTSCTS', 0))
+        cflag |= termios.CS8 | termios.CLOCAL | termios.CREAD
+        ispeed = ospeed = getattr(termios, f'B{baudrate}')
+        cc[termios.VMIN] = 0
+        cc[termios.VTIME] = 0
+        termios.tcsetattr(self.fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, ispeed, ospeed, cc])
+
+    def _rs485(self, delay_before_tx, rts_level_for_tx, rts_level_for_rx):
+        '''Hand the RTS driver enable to the kernel. Returns False if the tty cannot.'''
+        flags = SER_RS485_ENABLED
+        if rts_level_for_tx:
+            flags |= SER_RS485_RTS_ON_SEND
+        if rts_level_for_rx:
+            flags |= SER_RS485_RTS_AFTER_SEND
+        settings = RS485.pack(flags, round(delay_before_tx * 1000), 0, 0, 0, 0, 0, 0)
+        try:
+            fcntl.ioctl(self.fd, TIOCSRS485, settings)
+        except OSError as e:
+            if e.errno not in NOT_SUPPORTED:
+                raise
+            return False  # Pseudo-terminal or a driver without RS485 support
+        return True
+
+    def fileno(self):
+        return self.fd
+
+    @property
+    def in_waiting(self):
+        return struct.unpack('I', fcntl.ioctl(self.fd, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+    def read(self, size=1):
+        '''
+        Up to size bytes, waiting up to timeout for the first one.
+        Returns a memoryview into the read buffer, valid until the next read().
+        '''
+        if not select.select((self.fd,), (), (), self.timeout)[0]:
+            return self.view[:0]
+        try:
+            count = os.readv(self.fd, (self.view[:min(size, len(self.buffer))],))
+        except BlockingIOError:
+            return self.view[:0]
+        if not count:  # Readable but nothing to read: the adapter was unplugged
+            raise OSError(errno.EIO, f'{self.port} reports readiness to read but returned no data')
+        return self.view[:count]
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.fd, view):]
+            except BlockingIOError:
+                select.select((), (self.fd,), (), 1.0)  # Output buffer full, wait for room
+        return len(data)
+
+    def reset_input_buffer(self):
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
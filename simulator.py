@@ -0,0 +1,268 @@
+'''
+ERV bus simulator on a pseudo-terminal, for testing and benchmarking
+without an ERV (or without risking the one in the basement).
+
+It plays both the ERV (ID 10) and one wall control (VAUTOW 11 or
+VTTOUCHW 12) on the master side of a pty pair, and the slave side is
+an ordinary serial port name (/dev/pts/N) for the scripts to open:
+  ~18 ms          ERV/wall control poll call (x04) and response (x05)
+  ~3.5 ms         Between every call and response
+  ~3 sec          Telemetry register read exchange (see telemetry.py)
+  ~10 sec         VAUTOW timing/counter packet (x0014)
+  Commands        x40 register writes are acknowledged (x41, Rx1) and
+                  x20 register reads answered (x21, Rx3) after ~3.5 ms,
+                  and a x2000 mode write changes the mode the ERV reports
+See notes_vautow.txt and notes_vttouchw.txt for the captured frames.
+
+Bus faults can be injected:
+  collisions   Chance a command frame collides with bus traffic and is lost (no answer)
+  drops        Chance each byte the simulator sends is lost (torn frames, bad check sums)
+A command written while the simulator is transmitting also collides.
+Like a receiver that frames by line idle time, a partial frame is dropped
+at the end of each write, so a torn frame does not swallow the next one.
+
+speed scales every interval, so speed=10 polls every 1.8 ms and answers
+in 0.35 ms for throughput tests faster than the real bus.
+
+Command-line Usage:
+  python3 simulator.py vautow                                  <-- Prints the /dev/pts/N port
+  python3 simulator.py vttouchw --speed 10 --collisions 0.05 --drops 0.001
+  python3 vttouchw.py /dev/pts/N smart                         <-- In another terminal
+
+Module import usage in script:
+  from simulator import SIMULATOR
+  from vautow import VAUTOW
+  with SIMULATOR('vautow', speed=10) as sim:
+      erv = VAUTOW(sim.port)
+      erv.standby()
+      sim.mode        <-- 1 (standby)
+      sim.stats()
+'''
+
+import heapq
+import os
+import random
+import select
+import struct
+import threading
+import tty
+from time import monotonic
+from frames import PARSER, build
+
+ERV = 0x10
+WALL_CONTROLS = {'vautow': 0x11, 'vttouchw': 0x12}
+
+POLL_INTERVAL = 0.018
+RESPONSE_DELAY = 0.0035
+TELEMETRY_INTERVAL = 3.0
+COUNTER_INTERVAL = 10.0
+BYTE_TIME = 10 / 38400   # Start bit, 8 data bits, stop bit
+
+# Registers the ~3 sec telemetry exchange reads
+TELEMETRY_READS = {'vautow': (0x2002, 0x210c, 0x220a),
+                   'vttouchw': (0x2000, 0x2002)}
+
+
+class SIMULATOR:
+    def __init__(self,device='vautow',speed=1.0,collisions=0.0,drops=0.0,mode=0x01,seed=None):
+        self.device = device
+        self.wall = WALL_CONTROLS[device]
+        self.speed = speed
+        self.collisions = collisions     # Chance a command frame is lost in a collision
+        self.drops = drops               # Chance each sent byte is lost
+        self.random = random.Random(seed)
+        self.registers = {0x2000: bytes((mode,)), 0x2001: bytes((mode,)), 0x2002: bytes((mode,))}
+        self.counter = 0
+        self.master = self.slave = None
+        self.port = None
+        self.thread = None
+        self.running = False
+        self.parser = PARSER()
+        self.events = []                 # Heap of (time, sequence, frame or callable)
+        self.sequence = 0
+        self.busy_until = 0.0            # Simulated bus is transmitting until this time
+        self.last_command = float('-inf')
+        self.counts = {'polls': 0, 'telemetry': 0, 'received': 0, 'commands': 0, 'writes': 0,
+                       'reads': 0, 'collisions': 0, 'dropped_bytes': 0, 'overflow_bytes': 0}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def mode(self):
+        '''Mode byte the ERV reports (x2001/x2002).'''
+        return self.registers[0x2002][0]
+
+    def stats(self):
+        return dict(self.counts, errors=self.parser.errors, mode=self.mode)
+
+    def start(self):
+        '''
+        Open the pty pair and run the bus in a background thread.
+        '''
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        now = monotonic()
+        self._schedule(now, self._poll)
+        self._schedule(now + self._scale(TELEMETRY_INTERVAL), self._telemetry)
+        if self.device == 'vautow':
+            self._schedule(now + self._scale(COUNTER_INTERVAL), self._counter)
+        self.thread = threading.Thread(target=self.run, name=f'simulator {self.port}', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    def run(self):
+        while self.running:
+            timeout = max(0.0, self.events[0][0] - monotonic()) if self.events else 0.1
+            readable, _, _ = select.select((self.master,), (), (), min(timeout, 0.1))
+            now = monotonic()
+            if readable:
+                try:
+                    data = os.read(self.master, 4096)
+                except OSError:
+                    data = b''  # Nothing has the slave open yet
+                for frame in self.parser.feed(data):
+                    self._receive(bytes(frame), now)
+                self.parser.reset()  # The line goes idle after each write, drop a torn frame (VAUTOW INT Tx1)
+            while self.events and self.events[0][0] <= now:
+                _, _, event = heapq.heappop(self.events)
+                if callable(event):
+                    event(now)
+                else:
+                    self._send(event, now)
+
+    def _scale(self, seconds):
+        return seconds / self.speed
+
+    def _schedule(self, moment, event):
+        self.sequence += 1
+        heapq.heappush(self.events, (moment, self.sequence, event))
+
+    def _send(self, frame, now):
+        '''
+        Start sending one frame, losing bytes if drops are injected. Like a
+        real UART the frame arrives once its last byte is on the wire, and
+        a command written before then collides with it.
+        '''
+        if self.drops:
+            kept = bytes(byte for byte in frame if self.random.random() >= self.drops)
+            self.counts['dropped_bytes'] += len(frame) - len(kept)
+            frame = kept
+        self.busy_until = now + self._scale(len(frame) * BYTE_TIME)
+        self._schedule(self.busy_until, lambda now: self._write(frame))
+
+    def _write(self, frame):
+        try:
+            written = os.write(self.master, frame)
+        except BlockingIOError:
+            written = 0  # Nobody is reading the port, like an adapter's receive buffer overflowing
+        self.counts['overflow_bytes'] += len(frame) - written
+
+    def _poll(self, now):
+        '''
+        ERV and wall control take turns polling each other every ~18 ms,
+        except while the ERV is busy answering commands.
+        '''
+        if now - self.last_command < self._scale(POLL_INTERVAL):
+            self._schedule(now + self._scale(POLL_INTERVAL), self._poll)
+            return
+        caller, answerer = (ERV, self.wall) if self.counts['polls'] % 2 else (self.wall, ERV)
+        self._send(build(caller, answerer, b'\x04'), now)
+        self._schedule(now + self._scale(RESPONSE_DELAY), build(answerer, caller, b'\x05'))
+        self._schedule(now + self._scale(POLL_INTERVAL), self._poll)
+        self.counts['polls'] += 1
+
+    def _telemetry(self, now):
+        '''Register read exchange every ~3 sec, placed in the gap after a poll.'''
+        registers = TELEMETRY_READS[self.device]
+        call = build(ERV, self.wall, b'\x20' + b''.join(struct.pack('<H', register) for register in registers))
+        self._schedule(now + self._scale(2 * RESPONSE_DELAY), call)
+        self._schedule(now + self._scale(3 * RESPONSE_DELAY), self._answer(call))
+        self._schedule(now + self._scale(TELEMETRY_INTERVAL), self._telemetry)
+        self.counts['telemetry'] += 1
+
+    def _counter(self, now):
+        '''VAUTOW timing/counter packet every ~10 sec.'''
+        self.counter += 1
+        self.registers[0x0014] = struct.pack('<I', self.counter)
+        self._schedule(now + self._scale(2 * RESPONSE_DELAY),
+                       build(self.wall, ERV, b'\x21\x14\x00\x04' + self.registers[0x0014]))
+        self._schedule(now + self._scale(COUNTER_INTERVAL), self._counter)
+
+    def _receive(self, frame, now):
+        '''A frame written to the port by the script under test.'''
+        self.counts['received'] += 1
+        if frame[1] != ERV or frame[2] != self.wall or frame[4] < 2:
+            return  # Only answer register reads and writes addressed to this wall control
+        self.counts['commands'] += 1
+        self.last_command = now
+        if now < self.busy_until or (self.collisions and self.random.random() < self.collisions):
+            self.counts['collisions'] += 1
+            return
+        self._schedule(now + self._scale(RESPONSE_DELAY), self._answer(frame))
+
+    def _answer(self, frame):
+        '''
+        ERV response to a register read (x21 with the values) or
+        register write (x41 with the registers written, highest first).
+        '''
+        message = frame[5:-2]
+        if message[0] == 0x20:
+            self.counts['reads'] += 1
+            response = bytearray(b'\x21')
+            for position in range(1, len(message) - 1, 2):
+                register = message[position] | message[position + 1] << 8
+                data = self.registers.get(register, b'\x00')
+                response += message[position:position + 2] + bytes((len(data),)) + data
+        elif message[0] == 0x40:
+            self.counts['writes'] += 1
+            written = []
+            position = 1
+            while position + 3 <= len(message):
+                register = message[position] | message[position + 1] << 8
+                size = message[position + 2]
+                data = message[position + 3:position + 3 + size]
+                if size:
+                    self.registers[register] = data
+                    if register == 0x2000:  # Mode written, the ERV now reports it
+                        self.registers[0x2001] = self.registers[0x2002] = data
+                written.append(register)
+                position += 3 + size
+            response = b'\x41' + b''.join(struct.pack('<H', register) for register in sorted(written, reverse=True))
+        else:
+            return build(frame[2], frame[1], message)  # Unknown opcode, echo it back
+        return build(frame[2], frame[1], bytes(response))
+
+
+if __name__ == '__main__':
+    import sys
+    from time import sleep
+    if len(sys.argv) < 2 or sys.argv[1] not in WALL_CONTROLS:
+        print('Example command-line: python3 simulator.py vautow --speed 1 --collisions 0 --drops 0')
+    else:
+        option = lambda name, default: float(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+        sim = SIMULATOR(sys.argv[1], option('--speed', 1.0), option('--collisions', 0.0), option('--drops', 0.0))
+        sim.start()
+        print(f'Simulated {sys.argv[1]} bus on {sim.port}  (Ctrl+C to stop)')
+        try:
+            while True:
+                sleep(10)
+                print(sim.stats())
+        except KeyboardInterrupt:
+            sim.stop()
@@ -0,0 +1,87 @@
+'''
+Typed decoder for the register values the ERV and wall control exchange.
+
+The periodic frames that watch_vautow.py and watch_vttouchw.py skip are
+register reads (x20), read responses (x21) and writes (x40). Responses
+and writes carry (register, length, data) records, see tracker.py:
+  ...1d 20 02 20 0c 21 0a 22 ..  <-- Every ~3 sec, read x2002, x210c, x220a...
+  ...21 0f 50 04 ....            <-- Response, x500f is 4 bytes
+  ...91 21 0a f0 78 ....         <-- VTTOUCHW, xf00a is a 120 byte block
+
+TELEMETRY looks each register up in one dict (REGISTERS) that holds the
+field name and a precompiled struct, and updates a SNAPSHOT in place.
+Only the registers below have a known meaning so far. Every other
+register is kept as its raw bytes in SNAPSHOT.registers until it is
+identified and given a field here.
+
+Module import usage in script:
+  from bus import BUS
+  bus = BUS('/dev/ttyUSB0')
+  for frame in bus.frames(deadline):
+      pass
+  bus.telemetry.snapshot.mode
+  bus.telemetry.snapshot.as_dict()
+'''
+
+import struct
+from time import time
+from tracker import records
+
+U8 = struct.Struct('<B')
+U32 = struct.Struct('<I')
+F32 = struct.Struct('<f')
+
+# Register -> (SNAPSHOT field, struct)
+REGISTERS = {
+    0x2000: ('mode_set', U8),      # Mode written by the wall control
+    0x2001: ('mode', U8),          # Current mode (VAUTOW read back)
+    0x2002: ('mode', U8),          # Current mode (VTTOUCHW and ~3 sec exchange)
+    0x2206: ('float_2206', F32),   # 113.8 written by VAUTOW MED (9a 99 e3 42), meaning unknown
+    0x2208: ('float_2208', F32),   # 113.8 written by VAUTOW MED (9a 99 e3 42), meaning unknown
+    0x0014: ('counter', U32),      # VAUTOW timing/counter packet every 10 seconds
+    }
+
+
+class SNAPSHOT:
+    '''
+    Latest value of every decoded register field.
+    '''
+    __slots__ = ('mode', 'mode_set', 'float_2206', 'float_2208', 'counter',
+                 'registers', 'updated', 'frames')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.registers = {}  # Unidentified register -> raw bytes
+        self.frames = 0      # Frames that carried register values
+
+    def as_dict(self):
+        values = {name: getattr(self, name) for name in self.__slots__ if name != 'registers'}
+        values['registers'] = {f'{register:04x}': data.hex() for register, data in self.registers.items()}
+        return values
+
+
+class TELEMETRY:
+    def __init__(self):
+        self.snapshot = SNAPSHOT()
+        self.watchers = []  # Called with (field, time, value) for every decoded field, i.e. HISTORY.add
+
+    def feed(self, frame, now=None):
+        '''
+        Decode the register records in one bus frame into the snapshot.
+        '''
+        if frame.length < 4 or frame[5] not in (0x21, 0x40):
+            return
+        snapshot = self.snapshot
+        moment = time()
+        for register, data in records(frame.message):
+            field = REGISTERS.get(register)
+            if field is not None and len(data) == field[1].size:
+                value = field[1].unpack_from(data)[0]
+                setattr(snapshot, field[0], value)
+                for watcher in self.watchers:
+                    watcher(field[0], moment, value)
+            else:
+                snapshot.registers[register] = bytes(data)
+        snapshot.frames += 1
+        snapshot.updated = moment
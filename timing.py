@@ -0,0 +1,312 @@
+'''
+Bus timing analyzer, for sizing the command timeouts and transmit window
+(BUS.timeout, BUS.gap_timeout, delay_before_tx) from measurements
+instead of the eyeballed numbers in the notes ("~3.5 milliseconds
+between each call and response", "every ~18 milliseconds", ...).
+
+Measured from every frame, live on the bus or from a capture file:
+  gaps          Idle time between the end of one frame and the start of the next
+  after_poll    Idle time after a poll response (x05), where BUS writes commands
+  latency       Call to response time, per (caller, answerer) pair: a frame from
+                B to A answers the last frame from A to B
+  periods       Time between repeats of each frame type (sender, receiver, opcode,
+                first register), i.e. polls ~18 ms, telemetry ~3 sec, counter ~10 sec
+  utilization   Share of the time the bus carries bytes (10 bits per byte at 38400 baud)
+
+Frame times are when the last byte arrived (BUS, capture.py). Captures
+from logic.py have the time of the first byte, use start=True for those.
+Histograms have 20 logarithmic buckets per decade from 10 us to 10000 s,
+so a day of traffic costs a few hundred ints of memory. Capture files
+are measured all at once with NumPy when it is installed (TIMING.capture),
+which takes seconds for a day of traffic (10 to 20 million frames).
+
+Command-line Usage:
+  python3 timing.py erv.cap                     <-- Recorded with watch_*.py --record or logic.py --record
+  python3 timing.py erv.cap --start --json timing.json
+  python3 timing.py /dev/ttyUSB0 --seconds 60   <-- Live, listens without sending anything
+
+Module import usage in script:
+  from timing import TIMING
+  timing = TIMING()
+  bus.listeners.append(timing.feed)             <-- Live
+  replay('erv.cap', [timing.feed])              <-- From a capture (see capture.py)
+  TIMING().capture('erv.cap')                   <-- Same, vectorized (needs NumPy)
+  timing.report()
+'''
+
+import math
+from bisect import bisect
+from frames import FRAME
+
+BYTE_TIME = 10 / 38400  # Start + 8 data + stop bits
+LOWEST = 1e-5           # Seconds, first histogram bucket
+PER_DECADE = 20
+BUCKETS = 9 * PER_DECADE
+EDGES = tuple(LOWEST * 10 ** (index / PER_DECADE) for index in range(BUCKETS))  # Upper edge of each bucket
+MAX_LATENCY = 1.0       # Seconds, a later frame the other way is not a response
+ROUND_TRIP_BYTES = 39   # Longest command frame (VAUTOW MED, 25 bytes) and its confirmation (14 bytes)
+USB_LATENCY = 0.016     # Seconds, FTDI latency timer default: received bytes can wait this long in the adapter
+
+class HISTOGRAM:
+    '''Log-bucketed histogram of seconds with exact count, min, max and mean.'''
+    def __init__(self):
+        self.counts = [0] * (BUCKETS + 1)  # Last bucket holds everything above the range
+        self.count = 0
+        self.total = 0.0
+        self.low = math.inf
+        self.high = -math.inf
+
+    def add(self, seconds):
+        self.counts[bisect(EDGES, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.low:
+            self.low = seconds
+        if seconds > self.high:
+            self.high = seconds
+
+    def add_array(self, seconds):
+        '''Add a NumPy array of seconds at once.'''
+        import numpy as np
+        if not len(seconds):
+            return
+        counts = np.bincount(np.searchsorted(EDGES, seconds, side='right'), minlength=BUCKETS + 1)
+        self.counts = [a + b for a, b in zip(self.counts, counts.tolist())]
+        self.count += len(seconds)
+        self.total += float(seconds.sum())
+        self.low = min(self.low, float(seconds.min()))
+        self.high = max(self.high, float(seconds.max()))
+
+    def percentile(self, percent):
+        '''Upper edge of the bucket holding the percentile (within ~12%), clamped to min/max.'''
+        if not self.count:
+            return None
+        rank = math.ceil(percent / 100 * self.count)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                edge = EDGES[index] if index < BUCKETS else self.high
+                return min(max(edge, self.low), self.high)
+        return self.high
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        ms = lambda seconds: round(seconds * 1000, 3)
+        return {'count': self.count, 'min_ms': ms(self.low), 'p50_ms': ms(self.percentile(50)),
+                'p95_ms': ms(self.percentile(95)), 'p99_ms': ms(self.percentile(99)),
+                'max_ms': ms(self.high), 'mean_ms': ms(self.total / self.count)}
+
+
+class TIMING:
+    def __init__(self, start=False, byte_time=BYTE_TIME):
+        self.start = start            # Frame times are the first byte (logic.py) rather than the last
+        self.byte_time = byte_time
+        self.gaps = HISTOGRAM()
+        self.after_poll = HISTOGRAM()
+        self.latency = {}             # (caller << 8 | answerer) -> HISTOGRAM
+        self.periods = {}             # Frame type key -> HISTOGRAM
+        self.pending = {}             # (sender << 8 | receiver) -> end time of the last call
+        self.last = {}                # Frame type key -> start time of the last one
+        self.first = None             # Start time of the first frame
+        self.end = None               # End time of the last frame
+        self.previous_poll = False    # Last frame was a poll response
+        self.frames = 0
+        self.bytes = 0
+
+    def feed(self, frame, now):
+        '''Add one frame seen at time now (seconds). Usable as a BUS listener or replay consumer.'''
+        view = frame.view if type(frame) is FRAME else frame
+        size = len(view)
+        air = size * self.byte_time
+        if self.start:
+            begin, end = now, now + air
+        else:
+            begin, end = now - air, now
+        if self.end is None:
+            self.first = begin
+        else:
+            gap = begin - self.end
+            if gap < 0:
+                gap = 0.0  # Read timestamps jitter, back to back frames
+            self.gaps.add(gap)
+            if self.previous_poll:
+                self.after_poll.add(gap)
+        self.end = end
+        self.frames += 1
+        self.bytes += size
+        sender, receiver = view[1], view[2]
+        opcode = view[5] if size > 5 else 0
+        self.previous_poll = opcode == 0x05 and view[4] == 1
+        # Call/response: this frame answers the last frame sent the other way
+        pair = receiver << 8 | sender
+        call = self.pending.pop(pair, None)
+        if call is not None and begin - call < MAX_LATENCY:
+            histogram = self.latency.get(pair)
+            if histogram is None:
+                histogram = self.latency[pair] = HISTOGRAM()
+            histogram.add(max(begin - call, 0.0))
+        else:
+            self.pending[sender << 8 | receiver] = end
+        # Period of this frame type
+        key = (sender << 16 | receiver << 8 | opcode) << 16
+        if view[4] >= 3:
+            key |= view[6] | view[7] << 8
+        before = self.last.get(key)
+        self.last[key] = begin
+        if before is not None:
+            histogram = self.periods.get(key)
+            if histogram is None:
+                histogram = self.periods[key] = HISTOGRAM()
+            histogram.add(begin - before)
+
+    def capture(self, path):
+        '''
+        Measure a whole capture file at once with NumPy, the same as
+        feeding it frame by frame. Use on a new TIMING.
+        '''
+        import numpy as np
+        from capture import arrays
+        nanoseconds, starts, sizes, data = arrays(path)
+        if not len(starts):
+            return self
+        byte = lambda offset: np.where(sizes > offset, data[np.minimum(starts + offset, len(data) - 1)], 0).astype(np.int64)
+        now = nanoseconds / 1e9
+        air = sizes * self.byte_time
+        begin, end = (now, now + air) if self.start else (now - air, now)
+        gaps = np.maximum(begin[1:] - end[:-1], 0.0)  # Read timestamps jitter, back to back frames
+        sender, receiver, length, opcode = byte(1), byte(2), byte(4), byte(5)
+        poll = (opcode == 0x05) & (length == 1)
+        self.gaps.add_array(gaps)
+        self.after_poll.add_array(gaps[poll[:-1]])
+        self.first, self.end = float(begin[0]), float(end[-1])
+        self.frames += len(starts)
+        self.bytes += int(sizes.sum())
+        self.previous_poll = bool(poll[-1])
+        # Call/response: per device pair, a frame answers the frame before it if that went
+        # the other way and was not an answer itself, so answers alternate along a run
+        pair = np.minimum(sender, receiver) << 8 | np.maximum(sender, receiver)
+        order = np.argsort(pair, kind='stable')
+        pair, sent, received = pair[order], sender[order], receiver[order]
+        delay = begin[order][1:] - end[order][:-1]
+        other_way = np.zeros(len(order), bool)
+        other_way[1:] = (pair[1:] == pair[:-1]) & (sent[1:] == received[:-1]) & (sent[1:] != received[1:]) & \
+                        (delay < MAX_LATENCY)
+        index = np.arange(len(order))
+        run = np.maximum.accumulate(np.where(other_way & ~np.roll(other_way, 1), index, 0))
+        answer = other_way & ((index - run) % 2 == 0)
+        callers = (received << 8 | sent)[answer]
+        delays = np.maximum(np.append(0.0, delay)[answer], 0.0)
+        for key in np.unique(callers).tolist():
+            self.latency.setdefault(key, HISTOGRAM()).add_array(delays[callers == key])
+        # Period of each frame type
+        key = (sender << 16 | receiver << 8 | opcode) << 16 | np.where(length >= 3, byte(6) | byte(7) << 8, 0)
+        order = np.argsort(key, kind='stable')
+        key, begin = key[order], begin[order]
+        same = key[1:] == key[:-1]
+        periods, keys = (begin[1:] - begin[:-1])[same], key[1:][same]
+        bounds = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        for first, last in zip([0] + bounds.tolist(), bounds.tolist() + [len(keys)]):
+            if last > first:
+                self.periods.setdefault(int(keys[first]), HISTOGRAM()).add_array(periods[first:last])
+        ends = np.append(np.flatnonzero(key[1:] != key[:-1]), len(key) - 1)
+        self.last = dict(zip(key[ends].tolist(), begin[ends].tolist()))
+        return self
+
+    @staticmethod
+    def describe(key):
+        sender, receiver, opcode, register = key >> 32, key >> 24 & 0xff, key >> 16 & 0xff, key & 0xffff
+        name = f'{sender:02x}->{receiver:02x} x{opcode:02x}'
+        return f'{name} x{register:04x}' if register or opcode in (0x20, 0x21, 0x40, 0x41) else name
+
+    def report(self):
+        '''Everything measured so far as a dict (milliseconds).'''
+        span = (self.end - self.first) if self.frames > 1 else 0
+        return {
+            'frames': self.frames,
+            'bytes': self.bytes,
+            'seconds': round(span, 3),
+            'utilization': round(self.bytes * self.byte_time / span, 4) if span else None,
+            'gaps': self.gaps.summary(),
+            'after_poll': self.after_poll.summary(),
+            'latency': {f'{pair >> 8:02x}->{pair & 0xff:02x}': histogram.summary()
+                        for pair, histogram in sorted(self.latency.items())},
+            'periods': {self.describe(key): histogram.summary()
+                        for key, histogram in sorted(self.periods.items(), key=lambda item: -item[1].count)},
+            }
+
+    def suggest(self, read_interval=0.005, delay_before_tx=0.005, usb_latency=USB_LATENCY):
+        '''
+        Settings from the measurements: BUS.timeout (default 0.1) twice the
+        worst p99.9 response latency, but never less than a whole command
+        round trip as BUS sees it (delay_before_tx, the longest command and
+        confirmation on the wire, that latency, one read_interval and the
+        USB adapter latency), since the latency is measured between frames
+        on the wire and BUS only sees them after all of that. BUS.gap_timeout
+        (default 0.1) twice the p99 poll period, and the p5 idle time after a
+        poll response as the window a command frame has to fit in.
+        '''
+        worst = max((histogram.percentile(99.9) for histogram in self.latency.values()), default=None)
+        polls = [histogram.percentile(99) for key, histogram in self.periods.items()
+                 if key >> 16 & 0xff == 0x04 and not key & 0xffff]
+        window = self.after_poll.percentile(5)
+        timeout = None
+        if worst:
+            round_trip = delay_before_tx + ROUND_TRIP_BYTES * self.byte_time + worst + read_interval + usb_latency
+            timeout = round(max(2 * worst, round_trip), 4)
+        return {'timeout': timeout,
+                'gap_timeout': round(2 * max(polls), 4) if polls else None,
+                'transmit_window_ms': round(window * 1000, 3) if window is not None else None}
+
+
+def print_report(report, suggested):
+    line = lambda name, s: print(f"{name:28s} {s['count']:9d}  p50 {s['p50_ms']:9.3f}  p95 {s['p95_ms']:9.3f}  "
+                                 f"p99 {s['p99_ms']:9.3f}  max {s['max_ms']:10.3f} ms") if s['count'] else None
+    utilization = report['utilization']
+    print(f"{report['frames']:,} frames, {report['bytes']:,} bytes in {report['seconds']:,.1f} sec, "
+          f"utilization {100 * utilization if utilization else 0:.1f}%")
+    line('gap', report['gaps'])
+    line('idle after poll', report['after_poll'])
+    for pair, summary in report['latency'].items():
+        line(f'latency {pair}', summary)
+    for name, summary in report['periods'].items():
+        line(f'period {name}', summary)
+    print(f"suggested: timeout {suggested['timeout']} sec, gap_timeout {suggested['gap_timeout']} sec, "
+          f"transmit window {suggested['transmit_window_ms']} ms")
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='ERV bus timing from a capture file or a live serial port')
+    parser.add_argument('source', help='capture file (capture.py) or serial port')
+    parser.add_argument('--start', action='store_true', help='capture times are the first byte of each frame (logic.py)')
+    parser.add_argument('--seconds', type=float, default=60, help='how long to listen to a serial port')
+    parser.add_argument('--json', metavar='FILE', help='also write the report as JSON')
+    args = parser.parse_args()
+    timing = TIMING(start=args.start)
+    if args.source.startswith('/dev/'):
+        from time import monotonic
+        from bus import BUS
+        with BUS(args.source) as bus:
+            bus.listeners.append(timing.feed)
+            for frame in bus.frames(monotonic() + args.seconds):
+                pass
+    else:
+        try:
+            timing.capture(args.source)  # Vectorized with NumPy
+        except ImportError:
+            from capture import READER
+            reader = READER(args.source)
+            try:
+                for nanoseconds, view in reader:
+                    timing.feed(view, nanoseconds / 1e9)
+            finally:
+                view = None
+                reader.close()
+    report, suggested = timing.report(), timing.suggest()
+    print_report(report, suggested)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(dict(report, suggested=suggested), file, indent=2)
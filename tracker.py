@@ -0,0 +1,86 @@
+'''
+Passive ERV state tracker.
+
+The ERV reports its mode in x21 read responses on the bus, after every
+command (..21 01 20 01 <mode>..) and in the VTTOUCHW exchange
+(..21 02 20 01 <mode>..). TRACKER decodes these from every frame the
+session sees, so the mode is known after a reboot or when someone
+presses a button on the wall control, without sending anything.
+
+Read response message encoding:
+  21        Read response
+  RR RR     Register (little-endian, i.e. 01 20 is x2001)
+  NN        Data length in bytes
+  DD ...    Data
+  ...       Next register
+
+Module import usage in script:
+  from vautow import VAUTOW
+  erv = VAUTOW('/dev/ttyUSB0')
+  erv.mode()                <-- Listens to the bus until the ERV reports its mode
+  erv.bus.tracker.code      <-- Last mode byte reported by the ERV (or confirmed command)
+'''
+
+from time import monotonic
+
+MODE_REGISTERS = (0x2001, 0x2002)  # Current mode (x2000 is the mode being written)
+
+def records(message):
+    '''
+    Yield (register, data) for each register in a x21 read response or x40 write message.
+    '''
+    position = 1  # Skip the x21/x40 opcode
+    end = len(message)
+    while position + 3 <= end:
+        register = message[position] | message[position + 1] << 8
+        size = message[position + 2]
+        position += 3
+        if position + size > end:
+            return  # Not a register list (or a torn frame)
+        yield register, message[position:position + size]
+        position += size
+
+
+class TRACKER:
+    def __init__(self):
+        self.code = None   # Last mode byte reported by the ERV
+        self.time = None   # monotonic() time of that report
+        self.changes = 0   # Mode changes seen (button presses, other controllers, our commands)
+
+    def feed(self, frame, now=None):
+        '''
+        Update the shadow mode from one bus frame (only x21 read responses carry it).
+        '''
+        if frame.length < 5 or frame[5] != 0x21:
+            return
+        for register, data in records(frame.message):
+            if register in MODE_REGISTERS and len(data) == 1:
+                if data[0] != self.code:
+                    if self.code is not None:
+                        self.changes += 1
+                    self.code = data[0]
+                self.time = monotonic() if now is None else now
+
+    def commanded(self, code, now=None):
+        '''
+        A command for mode byte code was confirmed by the ERV, or failed (None).
+        VTTOUCHW commands are confirmed by a x41 acknowledgement, which does
+        not carry the mode, so the mode reported before is stale either way.
+        '''
+        if code is None:
+            self.time = None  # Unknown until the ERV reports it again
+            return
+        if code != self.code and self.code is not None:
+            self.changes += 1
+        self.code = code
+        self.time = monotonic() if now is None else now
+
+    def current(self, max_age=10, now=None):
+        '''
+        Mode byte if the ERV reported it within max_age seconds, otherwise None.
+        '''
+        if self.time is None:
+            return None
+        if (monotonic() if now is None else now) - self.time > max_age:
+            return None
+        return self.code
@@ -5,6 +5,9 @@ and GND wires on a VAUTOW ERV/HRV control panel.
 
 Command-line Usage:
   python3 vautow.py /dev/ttyUSB0 standby
+  python3 vautow.py commands                             <-- List commands (no serial imports)
+  python3 vautow.py /dev/ttyUSB0 --script evening.txt    <-- Several steps on one open port (see batch.py)
+  echo standby | python3 vautow.py /dev/ttyUSB0 -
 
 Module import usage in script:
   from vautow import VAUTOW
@@ -12,24 +15,61 @@ Module import usage in script:
   erv.commands()
   erv.auto()
   erv.standby()
+  erv.mode()      <-- Mode reported by the ERV on the bus
   erv.state
   erv.status
   help(erv)
 '''
 
-import serial.rs485
-from time import sleep
+from types import MappingProxyType
+from frames import build
+
+ERV = 0x10
+WALL_CONTROL = 0x11  # VAUTOW
+
+# Mode byte written to register x2000 (Tx2) and read back from x2001 (Rx3)
+MODES = {'standby': 0x01, 'auto': 0x10, 'turbo': 0x0c, 'recirc': 0x06,
+         'int': 0x08, 'min': 0x09, 'med': 0x0b, 'max': 0x0a}
+
+# 1st Data Frame message, '40 03 20 00' unless the mode sends more settings.
+SETUP = {'turbo': '40 00 22 04 40 38 00 00',
+         'med': '40 03 20 00 08 22 04 9a 99 e3 42 06 22 04 9a 99 e3 42'}
+
+# 1st Data Frames sent exactly as captured. The INT frame (notes_vautow.txt)
+# was torn at a x04 (LL says 11 bytes, 7 were captured), so it cannot be
+# built from a message until INT is captured again.
+CAPTURED = {'int': bytes.fromhex('01 10 11 01 0b 40 03 20 00 02 22 04 b0 04')}
+
+def _frames(mode):
+    tx1 = CAPTURED.get(mode) or build(ERV, WALL_CONTROL, bytes.fromhex(SETUP.get(mode, '40 03 20 00')))  # 1st Data Frame
+    tx2 = build(ERV, WALL_CONTROL, bytes((0x40, 0x00, 0x20, 0x01, MODES[mode])))   # 2nd Data Frame
+    tx3 = build(ERV, WALL_CONTROL, bytes((0x20, 0x01, 0x20)))                      # 3rd Data Frame
+    rx3 = build(WALL_CONTROL, ERV, bytes((0x21, 0x01, 0x20, 0x01, MODES[mode])))   # 3rd Data Frame ERV Response
+    return (tx1, tx2, tx3), rx3
+
+# Mode byte reported by the ERV -> command
+NAMES = {code: mode for mode, code in MODES.items()}
+
+# Every command and expected response frame, built once at import
+FRAMES = MappingProxyType({mode: _frames(mode) for mode in MODES})
 
 class VAUTOW:
-    def __init__(self,port='/dev/ttyUSB0'):
+    def __init__(self,port='/dev/ttyUSB0',bus=None):
         self.port = port
         self.baudrate = 38400
         self.attempts = 8
         self.timeout = 0.1
         self.delay_before_tx = 0.005
-        self.command_list = ['standby','auto','turbo','recirc','int','min','med','max']
+        if bus is None:
+            from bus import BUS  # pySerial is only imported once a port is used
+            bus = BUS(port,self.baudrate,self.timeout,self.delay_before_tx)  # Port opens on first command
+        self.bus = bus
+        self.port = self.bus.port
+        self.command_list = list(MODES)
         self.state = None
         self.status = None
+        self.max_age = 10            # Seconds a mode reported on the bus is trusted
+        self.skip_redundant = True   # Do not send a command for the mode the ERV is already in
 
     def commands(self):
         '''
@@ -38,51 +78,47 @@ class VAUTOW:
         self._command_string = ' | '.join(map(str,self.command_list))
         return print(f'ERV Control Options: {self._command_string}')
 
-    def send_frames(self):
+    def send_frames(self, command):
         '''
         Send command frames to the ERV/HRV over the RS485 wires.
         '''
+        self.state = command
+        if self._already(command):
+            return None
+        frames, expect = FRAMES[command]
         try:
-            self.ser=serial.rs485.RS485(port=self.port,baudrate=self.baudrate,timeout=self.timeout)
-            self.ser.rs485_mode = serial.rs485.RS485Settings(
-                rts_level_for_tx=False,
-                rts_level_for_rx=True,
-                delay_before_tx=self.delay_before_tx)
-        except:
+            used = self.bus.command(frames, expect, self.attempts)
+        except OSError:
+            self.status = 'FAILED'
             return print(f'{self.port} serial port not found')
+        return self._finish(used)
+
+    def mode(self):
+        '''
+        Current ERV mode as reported on the bus (None if it did not report it).
+        '''
+        code = self.bus.mode(self.max_age)
+        return NAMES.get(code, code)
+
+    def _already(self, command):
+        '''Skip the bus if the ERV recently reported it is in this mode.'''
+        if self.skip_redundant and self.bus.tracker.current(self.max_age) == MODES[command]:
+            self.status = 'OK'
+            print(f'ERV already in {command} mode')
+            return True
+        return False
 
-        # May need a few attempts to change the control state...
-        # pySerial RS485 support WARNING: This may work unreliably on some serial
-        # ports (control signals not synchronized or delayed compared to data). Using
-        # delays may be unreliable (varying times, larger than expected) as the OS
-        # may not support very fine grained delays.
-        self.status = ''
-        for i in range(self.attempts):
-            self.status += '.'  # Each dot represents one attempt in the loop
-            self.ser.write(self.Tx1)  # Send 1st Data Frame
-            self.ser.write(self.Tx2)  # Send 2nd Data Frame
-            self.ser.write(self.Tx3)  # Send 3rd Data Frame
-            self.resp = self.ser.read_until(expected=self.Rx3)  # Confirm Success with 3rd Data Frame ERV Response
-            if self.Rx3.hex() in self.resp.hex():
-                self.status += 'OK'
-                self.ser.close()
-                return print(f'{self.status}')
-            sleep(0.25)
-        else:
-            self.status += 'FAILED'
-            self.ser.close()
-            return print(f'{self.status}')
+    def _finish(self, used):
+        self.bus.tracker.commanded(MODES[self.state] if used else None)
+        self.status = '.' * (used or self.attempts)  # Each dot represents one attempt
+        self.status += 'OK' if used else 'FAILED'
+        return print(f'{self.status}')
 
     def standby(self):
         '''
         Standby (STB) - Stops ERV ventilation motor and closes internal dampers to outside ducts.
         '''
-        self.state = 'standby'
-        self.Tx1 = b'\x01\x10\x11\x01\x04\x40\x03\x20\x00\x77\x04'
-        self.Tx2 = b'\x01\x10\x11\x01\x05\x40\x00\x20\x01\x01\x77\x04'
-        self.Tx3 = b'\x01\x10\x11\x01\x03\x20\x01\x20\x9a\x04'
-        self.Rx3 = b'\x01\x11\x10\x01\x05\x21\x01\x20\x01\x01\x95\x04'
-        self.send_frames()
+        return self.send_frames('standby')
 
     def auto(self):
         '''
@@ -95,90 +131,64 @@ class VAUTOW:
             82°F to 91°F = 20 min/hr
                   > 91°F = 10 min/hr
         '''
-        self.state = 'auto'
-        self.Tx1 = b'\x01\x10\x11\x01\x04\x40\x03\x20\x00\x77\x04'
-        self.Tx2 = b'\x01\x10\x11\x01\x05\x40\x00\x20\x01\x10\x68\x04'
-        self.Tx3 = b'\x01\x10\x11\x01\x03\x20\x01\x20\x9a\x04'
-        self.Rx3 = b'\x01\x11\x10\x01\x05\x21\x01\x20\x01\x10\x86\x04'
-        self.send_frames()
+        return self.send_frames('auto')
 
     def turbo(self):
         '''
         Turbo (TUR) - Four hours of ventilation at MAX speed, then returns to previous setting.
         '''
-        self.state = 'turbo' 
-        self.Tx1 = b'\x01\x10\x11\x01\x08\x40\x00\x22\x04\x40\x38\x00\x00\xf8\x04'
-        self.Tx2 = b'\x01\x10\x11\x01\x05\x40\x00\x20\x01\x0c\x6c\x04'
-        self.Tx3 = b'\x01\x10\x11\x01\x03\x20\x01\x20\x9a\x04'
-        self.Rx3 = b'\x01\x11\x10\x01\x05\x21\x01\x20\x01\x0c\x8a\x04'
-        self.send_frames()
+        return self.send_frames('turbo')
 
     def recirc(self):
         '''
         Recirculation (REC) - Closes dampers to outside ducts and recirculates air inside the house at MAX speed.
         '''
-        self.state = 'recirc'
-        self.Tx1 = b'\x01\x10\x11\x01\x04\x40\x03\x20\x00\x77\x04'
-        self.Tx2 = b'\x01\x10\x11\x01\x05\x40\x00\x20\x01\x06\x72\x04'
-        self.Tx3 = b'\x01\x10\x11\x01\x03\x20\x01\x20\x9a\x04'
-        self.Rx3 = b'\x01\x11\x10\x01\x05\x21\x01\x20\x01\x06\x90\x04'
-        self.send_frames()
+        return self.send_frames('recirc')
 
     def int(self):
         '''
         Intermittent (INT) - Within a one hour period, operates at MIN speed for 20 minutes (20 min/hr).
         '''
-        self.state = 'int'
-        self.Tx1 = b'\x01\x10\x11\x01\x0b\x40\x03\x20\x00\x02\x22\x04\xb0\x04'
-        self.Tx2 = b'\x01\x10\x11\x01\x05\x40\x00\x20\x01\x08\x70\x04'
-        self.Tx3 = b'\x01\x10\x11\x01\x03\x20\x01\x20\x9a\x04'
-        self.Rx3 = b'\x01\x11\x10\x01\x05\x21\x01\x20\x01\x08\x8e\x04'
-        self.send_frames()
+        return self.send_frames('int')
 
     def min(self):
         '''
         Minimum (MIN) - Continuous exchange ventilation at selected speed.
         '''
-        self.state = 'min'
-        self.Tx1 = b'\x01\x10\x11\x01\x04\x40\x03\x20\x00\x77\x04'
-        self.Tx2 = b'\x01\x10\x11\x01\x05\x40\x00\x20\x01\x09\x6f\x04'
-        self.Tx3 = b'\x01\x10\x11\x01\x03\x20\x01\x20\x9a\x04'
-        self.Rx3 = b'\x01\x11\x10\x01\x05\x21\x01\x20\x01\x09\x8d\x04'
-        self.send_frames()
+        return self.send_frames('min')
 
     def med(self):
         '''
         Medium (MED) - Continuous exchange ventilation at selected speed.
         '''
-        self.state = 'med'
-        self.Tx1 = b'\x01\x10\x11\x01\x12\x40\x03\x20\x00\x08\x22\x04\x9a\x99\xe3\x42\x06\x22\x04\x9a\x99\xe3\x42\x5f\x04'
-        self.Tx2 = b'\x01\x10\x11\x01\x05\x40\x00\x20\x01\x0b\x6d\x04'
-        self.Tx3 = b'\x01\x10\x11\x01\x03\x20\x01\x20\x9a\x04'
-        self.Rx3 = b'\x01\x11\x10\x01\x05\x21\x01\x20\x01\x0b\x8b\x04'
-        self.send_frames()
+        return self.send_frames('med')
 
     def max(self):
         '''
         Maximum (MAX) - Continuous exchange ventilation at selected speed.
         '''
-        self.state = 'max'
-        self.Tx1 = b'\x01\x10\x11\x01\x04\x40\x03\x20\x00\x77\x04'
-        self.Tx2 = b'\x01\x10\x11\x01\x05\x40\x00\x20\x01\x0a\x6e\x04'
-        self.Tx3 = b'\x01\x10\x11\x01\x03\x20\x01\x20\x9a\x04'
-        self.Rx3 = b'\x01\x11\x10\x01\x05\x21\x01\x20\x01\x0a\x8c\x04'
-        self.send_frames()
+        return self.send_frames('max')
 
 if __name__ == '__main__':
     import sys
     if len(sys.argv) < 3:  # No commands or wrong number of arguments
-        erv = VAUTOW()
-        print('Example command-line: python3 vautow.py /dev/ttyUSB0 standby')
-        erv.commands()
+        if sys.argv[1:] != ['commands']:
+            print('Example command-line: python3 vautow.py /dev/ttyUSB0 standby')
+        print(f"ERV Control Options: {' | '.join(MODES)}")  # Same as erv.commands(), without opening a bus
+    elif sys.argv[2] == '-' or (sys.argv[2] == '--script' and len(sys.argv) > 3):
+        from batch import main
+        sys.exit(0 if main('vautow', sys.argv[1], sys.argv[3] if sys.argv[2] == '--script' else '-') else 1)
     else:
+        from ervd import request  # Use the bus broker daemon if it owns this port
+        reply = request({'request': 'command', 'port': sys.argv[1], 'device': 'vautow', 'command': sys.argv[2]})
+        if reply is not None and not reply.get('elsewhere'):
+            print(reply.get('status') or reply.get('error'))
+            sys.exit()
         try:
             erv = VAUTOW(sys.argv[1])
             func = getattr(erv, sys.argv[2].lower())
             func()  # calls erv.command()
+            erv.bus.close()
         except AttributeError:
             print(f'{sys.argv[2]} command not found')
             erv.commands()
@@ -5,6 +5,9 @@ and GND wires on a VTTOUCHW ERV/HRV control panel.
 
 Command-line Usage:
   python3 vttouchw.py /dev/ttyUSB0 standby
+  python3 vttouchw.py commands                             <-- List commands (no serial imports)
+  python3 vttouchw.py /dev/ttyUSB0 --script evening.txt    <-- Several steps on one open port (see batch.py)
+  echo standby | python3 vttouchw.py /dev/ttyUSB0 -
 
 Module import usage in script:
   from vttouchw import VTTOUCHW
@@ -12,25 +15,49 @@ Module import usage in script:
   erv.commands()
   erv.smart()
   erv.standby()
+  erv.mode()      <-- Mode reported by the ERV on the bus
   erv.state
   erv.status
   help(erv)
 '''
 
-import serial.rs485
-from time import sleep
+from types import MappingProxyType
+from frames import build
+
+ERV = 0x10
+WALL_CONTROL = 0x12  # VTTOUCHW
+
+# Mode byte written to register x2000 (with x2008 = 00)
+MODES = {'standby': 0x01, 'smart': 0x11, 'away': 0x0f, 'min': 0x09, 'med': 0x0b, 'max': 0x0a,
+         'recircmin': 0x05, 'recircmed': 0x07, 'recircmax': 0x06}
+
+# Same ERV response for all control commands
+RX1 = build(WALL_CONTROL, ERV, bytes((0x41, 0x08, 0x20, 0x00, 0x20)))
+
+# Mode byte reported by the ERV -> command
+NAMES = {code: mode for mode, code in MODES.items()}
+
+# Every command and expected response frame, built once at import
+FRAMES = MappingProxyType({mode: ((build(ERV, WALL_CONTROL, bytes((0x40, 0x00, 0x20, 0x01, MODES[mode], 0x08, 0x20, 0x01, 0x00))),), RX1)
+                           for mode in MODES})
 
 class VTTOUCHW:
-    def __init__(self,port='/dev/ttyUSB0'):
+    def __init__(self,port='/dev/ttyUSB0',bus=None):
         self.port = port
         self.baudrate = 38400
         self.attempts = 8
         self.timeout = 0.1
         self.delay_before_tx = 0.005
-        self.command_list = ['standby','smart','away','min','med','max','recircmin','recircmed','recircmax']
+        if bus is None:
+            from bus import BUS  # pySerial is only imported once a port is used
+            bus = BUS(port,self.baudrate,self.timeout,self.delay_before_tx)  # Port opens on first command
+        self.bus = bus
+        self.port = self.bus.port
+        self.command_list = list(MODES)
         self.status = None
         self.state = None
-        self.Rx1 = b'\x01\x12\x10\x01\x05\x41\x08\x20\x00\x20\x4f\x04'  # Same ERV response for all control commands
+        self.max_age = 10            # Seconds a mode reported on the bus is trusted
+        self.skip_redundant = True   # Do not send a command for the mode the ERV is already in
 
     def commands(self):
         '''
@@ -39,123 +66,117 @@ class VTTOUCHW:
         self._command_string = ' | '.join(map(str,self.command_list))
         return print(f'ERV Control Options: {self._command_string}')
 
-    def send_frames(self):
+    def send_frames(self, command):
         '''
         Send command frames to the ERV/HRV over the RS485 wires.
         '''
+        self.state = command
+        if self._already(command):
+            return None
+        frames, expect = FRAMES[command]
         try:
-            self.ser=serial.rs485.RS485(port=self.port,baudrate=self.baudrate,timeout=self.timeout)
-            self.ser.rs485_mode = serial.rs485.RS485Settings(
-                rts_level_for_tx=False,
-                rts_level_for_rx=True,
-                delay_before_tx=self.delay_before_tx)
-        except:
+            used = self.bus.command(frames, expect, self.attempts)
+        except OSError:
+            self.status = 'FAILED'
             return print(f'{self.port} serial port not found')
+        return self._finish(used)
+
+    def mode(self):
+        '''
+        Current ERV mode as reported on the bus (None if it did not report it).
+        '''
+        code = self.bus.mode(self.max_age)
+        return NAMES.get(code, code)
+
+    def _already(self, command):
+        '''Skip the bus if the ERV recently reported it is in this mode.'''
+        if self.skip_redundant and self.bus.tracker.current(self.max_age) == MODES[command]:
+            self.status = 'OK'
+            print(f'ERV already in {command} mode')
+            return True
+        return False
 
-        # May need a few attempts to change the control state...
-        # pySerial RS485 support WARNING: This may work unreliably on some serial
-        # ports (control signals not synchronized or delayed compared to data). Using
-        # delays may be unreliable (varying times, larger than expected) as the OS
-        # may not support very fine grained delays.
-        self.status = ''
-        for i in range(self.attempts):
-            self.status += '.'  # Each dot represents one attempt in the loop
-            self.ser.write(self.Tx1)
-            self.resp = self.ser.read_until(expected=self.Rx1)  # Confirm Success with ERV Response Frame
-            if self.Rx1 in self.resp:
-                self.status += 'OK'
-                self.ser.close()
-                return print(f'{self.status}')
-            sleep(0.25)
-        else:
-            self.status += 'FAILED'
-            self.ser.close()
-            return print(f'{self.status}')
+    def _finish(self, used):
+        self.bus.tracker.commanded(MODES[self.state] if used else None)
+        self.status = '.' * (used or self.attempts)  # Each dot represents one attempt
+        self.status += 'OK' if used else 'FAILED'
+        return print(f'{self.status}')
 
     def standby(self):
         '''
         Standby (STB) - Stops ERV ventilation motor and closes internal dampers to outside ducts.
         '''
-        self.state = 'standby'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x01\x08\x20\x01\x00\x49\x04'
-        self.send_frames()
+        return self.send_frames('standby')
 
     def smart(self):
         '''
         Smart (SMT) - Operates automatically based on outdoor temperature and indoor humidity.
         '''
-        self.state = 'smart'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x11\x08\x20\x01\x00\x39\x04'
-        self.send_frames()
+        return self.send_frames('smart')
 
     def min(self):
         '''
         Continuous Minimum - Continuous exchange ventilation at selected speed.
         '''
-        self.state = 'min'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x09\x08\x20\x01\x00\x41\x04'
-        self.send_frames() 
+        return self.send_frames('min')
 
     def med(self):
         '''
         Continuous Medium - Continuous exchange ventilation at selected speed.
         '''
-        self.state = 'med'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x0b\x08\x20\x01\x00\x3f\x04'
-        self.send_frames()
+        return self.send_frames('med')
 
     def max(self):
         '''
         Continuous Maximum - Continuous exchange ventilation at selected speed.
         '''
-        self.state = 'max'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x0a\x08\x20\x01\x00\x40\x04'
-        self.send_frames()
+        return self.send_frames('max')
 
     def recircmin(self):
         '''
         Recirculation Minimum - Closes dampers to outside ducts and recirculates air inside house at MIN speed.
         '''
-        self.state = 'recircmin'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x05\x08\x20\x01\x00\x45\x04'
-        self.send_frames()
+        return self.send_frames('recircmin')
 
     def recircmed(self):
         '''
         Recirculation Medium - Closes dampers to outside ducts and recirculates air inside house at MED speed.
         '''
-        self.state = 'recircmed'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x07\x08\x20\x01\x00\x43\x04'
-        self.send_frames()
+        return self.send_frames('recircmed')
 
     def recircmax(self):
         '''
         Recirculation Maximum - Closes dampers to outside ducts and recirculates air inside house at MAX speed.
         '''
-        self.state = 'recircmax'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x06\x08\x20\x01\x00\x44\x04'
-        self.send_frames()
+        return self.send_frames('recircmax')
 
     def away(self):
         '''
         Away - 10 minutes outside ventilation / 50 minutes off every hour.
         '''
-        self.state = 'away'
-        self.Tx1 = b'\x01\x10\x12\x01\x09\x40\x00\x20\x01\x0f\x08\x20\x01\x00\x3b\x04'
-        self.send_frames() 
+        return self.send_frames('away')
 
 
 if __name__ == '__main__':
     import sys
     if len(sys.argv) < 3:  # No commands or wrong number of arguments
-        erv = VTTOUCHW()
-        print('Example command-line: python3 vttouchw.py /dev/ttyUSB0 standby')
-        erv.commands()
+        if sys.argv[1:] != ['commands']:
+            print('Example command-line: python3 vttouchw.py /dev/ttyUSB0 standby')
+        print(f"ERV Control Options: {' | '.join(MODES)}")  # Same as erv.commands(), without opening a bus
+    elif sys.argv[2] == '-' or (sys.argv[2] == '--script' and len(sys.argv) > 3):
+        from batch import main
+        sys.exit(0 if main('vttouchw', sys.argv[1], sys.argv[3] if sys.argv[2] == '--script' else '-') else 1)
     else:
+        from ervd import request  # Use the bus broker daemon if it owns this port
+        reply = request({'request': 'command', 'port': sys.argv[1], 'device': 'vttouchw', 'command': sys.argv[2]})
+        if reply is not None and not reply.get('elsewhere'):
+            print(reply.get('status') or reply.get('error'))
+            sys.exit()
         try:
             erv = VTTOUCHW(sys.argv[1])
             func = getattr(erv, sys.argv[2].lower())
             func()  # calls erv.command()
+            erv.bus.close()
         except AttributeError:
             print(f'{sys.argv[2]} command not found')
             erv.commands()
@@ -1,32 +1,46 @@
 # Requires USB-to-RS485 device connected to D+, D-, and GND
+# Optional: python3 watch_vautow.py --history erv_history   <-- Also keep decoded telemetry (see history.py)
+# Optional: python3 watch_vautow.py --record erv.cap        <-- Also record every frame with timestamps (see capture.py)
+# Optional: python3 watch_vautow.py --show control,unknown  <-- Frame classes to print (default control,confirmation,unknown, or --all)
 
 import serial.rs485
 import sys
+from frames import PARSER
+from telemetry import TELEMETRY
+from classify import classify, CLASSES, CONTROL, CONFIRMATION, UNKNOWN
 sys.tracebacklimit = 0  # Avoid Traceback error on Ctrl+C exit
 
 PORT = '/dev/ttyUSB0'
+HISTORY_DIR = sys.argv[sys.argv.index('--history') + 1] if '--history' in sys.argv else None  # Keep decoded telemetry
+RECORD_FILE = sys.argv[sys.argv.index('--record') + 1] if '--record' in sys.argv else None    # Binary capture file
+
+# Frame classes to print (see classify.py), polls, telemetry and the counter repeat and are not control signals
+SHOW = set(sys.argv[sys.argv.index('--show') + 1].split(',')) if '--show' in sys.argv else {CONTROL, CONFIRMATION, UNKNOWN}
+SHOW = set(CLASSES) if '--all' in sys.argv else SHOW
 
 try:
     ser=serial.rs485.RS485(port=PORT,baudrate=38400)
     ser.rs485_mode = serial.rs485.RS485Settings(rts_level_for_tx=False,rts_level_for_rx=True)
 
-    # Repeating sequences not related to control signals
-    # You will still see some kind of timing/counter frame every 10 seconds...
-    skip = [
-        b'\x01\x10\x11\x01\x01\x04\xd9\x04', b'\x01\x10\x11\x01\x01\x05\xd8\x04',
-        b'\x01\x11\x10\x01\x01\x04\xd9\x04', b'\x01\x11\x10\x01\x01\x05\xd8\x04',
-        b'\x01\x11\x10\x01\x54\x21\x0f\x50\x04', b'\x01\x11\x10\x01\x03\x41\x07\x50\x43\x04',
-        b'\x01\x10\x11\x01\x08\x40\x07\x50\x04\xff\xff\xff\xff\x3f\x04',
-        b'\x01\x10\x11\x01\x03\x20\x14\x00\xa7\x04', b'\x01\x11\x10\x01\x03\x41\x00\x50\x4a\x04',
-        b'\x01\x10\x11\x01\x04\x40\x00\x50\x00\x4a\x04',
-        b'\x01\x10\x11\x01\x1d\x20\x02\x20\x0c\x21\x0a\x22\x0f\x22\x00\x30\x02\x30\x00\x22\x17\x00\x0e\x50\x0f\x50\x0a\x50\x0b\x50\x08\x22\x06\x22\x96\x04']
-  
     # Watch frames scroll by...
+    parser = PARSER()  # Uses the LL length byte, so x04 inside a message does not split the frame
+    telemetry = TELEMETRY()
+    if HISTORY_DIR:
+        from history import HISTORY
+        history = HISTORY(HISTORY_DIR).watch(telemetry)
+    if RECORD_FILE:
+        from capture import RECORDER
+        recorder = RECORDER(RECORD_FILE)
     while True:
-        frame = ser.read_until(expected=b'\x04\x00')[:-1]  # Frame Footer is usually x04
-        if (frame not in skip) and (frame.hex()[0] == '0') and (frame.hex()[1] == '1'):  # Frame Header is x01
-            print(frame.hex())
+        for frame in parser.feed(ser.read(ser.in_waiting or 1)):
+            telemetry.feed(frame)
+            if RECORD_FILE:
+                recorder.write(frame)
+            if classify(frame) in SHOW:
+                print(frame.hex())
 
 except Exception or KeyboardInterrupt:
+    if RECORD_FILE:
+        recorder.close()
     ser.close()
 